@@ -0,0 +1,252 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import replace
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image as PILImage
+
+from lib.parse_3db import Deserializer, Model, load_3db, parse_3db_file, read_header
+from lib.export import export_to_gltf
+from lib.profiling import Profiler, NO_PROFILER
+from lib.textures import TEXTURE_FILE_ENDING, TEXTURE_FOLDERS, TextureCache
+from lib.write_3db import save_3db, write_3db
+from benchmarks.synthetic import SyntheticSpec, synthetic_model
+
+DEFAULT_MODEL = os.path.join(os.path.dirname(__file__), '..', '..', 'assets', 'baby.3db')
+# Scalar Deserializer reads are slow, so that benchmark only reads this many values
+MAX_SCALAR_READS = 1 << 18
+
+# Runs fn repeat times for the timings, then once more under tracemalloc for the peak memory,
+# as tracing slows down every allocation
+def measure(fn: Callable[[], object], repeat: int) -> Dict:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds_min': min(times), 'seconds_mean': sum(times) / len(times), 'peak_memory_bytes': peak}
+
+def result(name: str, corpus: str, input_bytes: int, items: int, item_unit: str, timing: Dict) -> Dict:
+    seconds = timing['seconds_min']
+    return {
+        'benchmark': name,
+        'corpus': corpus,
+        'input_bytes': input_bytes,
+        'items': items,
+        'item_unit': item_unit,
+        **timing,
+        'mb_per_s': input_bytes / (1024 * 1024) / seconds if seconds > 0 else None,
+        'items_per_s': items / seconds if seconds > 0 else None,
+    }
+
+def touch_pools(model: Model):
+    for pool in (model.triangle_data, model.texture_coordinates_data, model.vertex_data, model.brightness_data):
+        for entry in pool:
+            pass
+
+# Writes a random size x size TGA for every material of model into texture_root
+def write_model_textures(model: Model, size: int, texture_root: str):
+    texture_folder = os.path.join(texture_root, TEXTURE_FOLDERS[0])
+    os.makedirs(texture_folder, exist_ok=True)
+    rng = np.random.default_rng(0)
+    for material in model.materials:
+        texture_path = os.path.join(texture_folder, material.name + TEXTURE_FILE_ENDING)
+        PILImage.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8)).save(texture_path)
+
+# Exports into a new folder inside output_folder, so the textures of texture_root are converted again on every run
+def quiet_export(model: Model, output_folder: str, texture_root: str, profiler: Profiler = NO_PROFILER):
+    texture_cache = TextureCache(tempfile.mkdtemp(dir=output_folder), texture_root=texture_root)
+    try:
+        # export_to_gltf reports every conversion on stdout, which is reserved for the results
+        with contextlib.redirect_stdout(io.StringIO()):
+            export_to_gltf(model, 'benchmark', texture_cache.output_folder, texture_cache, profiler=profiler)
+    finally:
+        texture_cache.close()
+
+# Profiler phases of export_to_gltf that are reported as results of their own
+EXPORT_PHASES = {
+    # Vertices, texture coordinates and indices of the first keyframe of every object
+    'base_meshes': 'export_geometry',
+    'morph_targets': 'export_morph_targets',
+    'animation_weights': 'export_animation_weights',
+    # Requesting and waiting for the texture conversions
+    'textures': 'export_textures',
+    # Building the glTF JSON and writing the files
+    'serialize': 'export_serialize',
+}
+
+# Like measure for the phases of export_to_gltf, timed by a profiler. The peak memory of each phase comes from
+# one more run with memory tracing. Returns the timing of every phase and the counters of the traced run
+def measure_export_phases(model: Model, output_folder: str, texture_root: str, repeat: int) -> Tuple[Dict[str, Dict], Dict[str, int]]:
+    times = {phase: [] for phase in EXPORT_PHASES}
+    for _ in range(repeat):
+        profiler = Profiler(enabled=True, trace_memory=False)
+        quiet_export(model, output_folder, texture_root, profiler)
+        for phase in EXPORT_PHASES:
+            times[phase].append(profiler.phases.get(phase, {'seconds': 0.0})['seconds'])
+    profiler = Profiler(enabled=True)
+    profiler.start()
+    try:
+        quiet_export(model, output_folder, texture_root, profiler)
+    finally:
+        profiler.stop()
+    timings = {phase: {'seconds_min': min(times[phase]), 'seconds_mean': sum(times[phase]) / len(times[phase]),
+                       'peak_memory_bytes': profiler.phases.get(phase, {'peak_bytes': 0})['peak_bytes']}
+               for phase in EXPORT_PHASES}
+    return timings, profiler.counters
+
+def bench_model(corpus: str, path: str, repeat: int, texture_size: int, work_folder: str) -> List[Dict]:
+    with open(path, 'rb') as f:
+        data = f.read()
+    size = len(data)
+    header = read_header(Deserializer(data))
+    layout = header.layout
+    keyframe_count = len(header.keyframes)
+    vertex_offset = layout.pool_offsets()[2]
+    scalar_reads = min(3 * int(layout.vertex_counts.sum()), MAX_SCALAR_READS)
+    array_reads = 3 * int(layout.vertex_counts.sum())
+
+    def read_scalars():
+        deserializer = Deserializer(data)
+        deserializer.offset = vertex_offset
+        for _ in range(scalar_reads):
+            deserializer.read_u16()
+
+    def read_array():
+        deserializer = Deserializer(data)
+        deserializer.offset = vertex_offset
+        deserializer.read_array('<u2', array_reads)
+
+    model = parse_3db_file(data)
+    export_folder = os.path.join(work_folder, 'out')
+    os.makedirs(export_folder, exist_ok=True)
+    texture_root = os.path.join(work_folder, 'textures', corpus)
+    write_model_textures(model, texture_size, texture_root)
+    phase_timings, counters = measure_export_phases(model, export_folder, texture_root, repeat)
+    frame_count = sum(len(animation.keyframes) for animation in model.animations)
+    phase_items = {
+        'base_meshes': (len(model.objects), 'objects'),
+        'morph_targets': (counters.get('morph_targets', 0), 'morph_targets'),
+        'animation_weights': (frame_count, 'frames'),
+        'textures': (len(model.materials), 'materials'),
+        'serialize': (counters.get('accessors', 0), 'accessors'),
+    }
+
+    results = [
+        result('read_header', corpus, layout.pools_offset, keyframe_count, 'keyframes',
+               measure(lambda: read_header(Deserializer(data)), repeat)),
+        result('deserializer_read_u16', corpus, 2 * scalar_reads, scalar_reads, 'values', measure(read_scalars, repeat)),
+        result('deserializer_read_array', corpus, 2 * array_reads, array_reads, 'values', measure(read_array, repeat)),
+        result('parse_3db_file', corpus, size, keyframe_count, 'keyframes', measure(lambda: parse_3db_file(data), repeat)),
+        result('load_3db', corpus, size, keyframe_count, 'keyframes', measure(lambda: touch_pools(load_3db(path)), repeat)),
+        result('write_3db', corpus, size, keyframe_count, 'keyframes', measure(lambda: write_3db(model), repeat)),
+        # The whole export_to_gltf, then each of its phases on its own
+        result('export', corpus, size, keyframe_count, 'keyframes', measure(lambda: quiet_export(model, export_folder, texture_root), repeat)),
+    ]
+    for phase, name in EXPORT_PHASES.items():
+        items, item_unit = phase_items[phase]
+        results.append(result(name, corpus, size, items, item_unit, phase_timings[phase]))
+    return results
+
+# Converts count random TGAs of size x size pixels, each run into an empty output folder
+def bench_textures(count: int, size: int, repeat: int, work_folder: str) -> List[Dict]:
+    texture_folder = os.path.join(work_folder, TEXTURE_FOLDERS[0])
+    os.makedirs(texture_folder, exist_ok=True)
+    rng = np.random.default_rng(0)
+    names = [f'texture_{n}' for n in range(count)]
+    input_bytes = 0
+    for texture_name in names:
+        texture_path = os.path.join(texture_folder, texture_name + TEXTURE_FILE_ENDING)
+        PILImage.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8)).save(texture_path)
+        input_bytes += os.path.getsize(texture_path)
+
+    def convert():
+        output_folder = tempfile.mkdtemp(dir=work_folder)
+        texture_cache = TextureCache(output_folder, texture_root=work_folder)
+        try:
+            for texture_name in names:
+                texture_cache.request(texture_name)
+            texture_cache.wait()
+        finally:
+            texture_cache.close()
+
+    return [result('textures', f'tga-{count}x{size}', input_bytes, count, 'textures', measure(convert, repeat))]
+
+def corpus_specs(args) -> List[SyntheticSpec]:
+    specs = {}
+    base = SyntheticSpec()
+    for vertices in args.vertices:
+        spec = replace(base, vertices=vertices)
+        specs[spec.name] = spec
+    for keyframes in args.keyframes:
+        spec = replace(base, keyframes=keyframes)
+        specs[spec.name] = spec
+    for objects in args.objects:
+        spec = replace(base, objects=objects)
+        specs[spec.name] = spec
+    return list(specs.values())
+
+parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                 description='Time the parse and export phases on real and synthetic .3db files')
+parser.add_argument('models', nargs='*', help=f'.3db files to benchmark (default: {os.path.normpath(DEFAULT_MODEL)})')
+parser.add_argument('-r', '--repeat', type=int, default=3, help='timed runs per benchmark, the fastest is reported')
+parser.add_argument('-o', '--output', help='write the JSON results to this file instead of stdout')
+parser.add_argument('--vertices', type=int, nargs='*', default=[500, 2000, 8000],
+                    help='vertices per mesh of the synthetic models scaled by vertex count')
+parser.add_argument('--keyframes', type=int, nargs='*', default=[64, 256, 1024],
+                    help='keyframes per object of the synthetic models scaled by keyframe count')
+parser.add_argument('--objects', type=int, nargs='*', default=[1, 4, 16],
+                    help='object count of the synthetic models scaled by object count')
+parser.add_argument('--textures', type=int, default=8, help='number of textures in the texture benchmark, 0 skips it')
+parser.add_argument('--texture-size', type=int, default=256,
+                    help='width and height of the generated textures, also those of the exported models')
+args = parser.parse_args()
+
+model_paths = [os.path.abspath(path) for path in args.models or [DEFAULT_MODEL]]
+original_folder = os.getcwd()
+results = []
+# Textures are looked up relative to the working directory, so everything runs in an empty temporary one
+with tempfile.TemporaryDirectory() as work_folder:
+    os.chdir(work_folder)
+    corpora = [(os.path.basename(path), path) for path in model_paths]
+    for spec in corpus_specs(args):
+        path = os.path.join(work_folder, spec.name + '.3db')
+        save_3db(synthetic_model(spec), path)
+        corpora.append((spec.name, path))
+
+    for corpus, path in corpora:
+        print(f'Benchmarking {corpus}', file=sys.stderr)
+        results += bench_model(corpus, path, args.repeat, args.texture_size, work_folder)
+    if args.textures > 0:
+        print(f'Benchmarking {args.textures} textures', file=sys.stderr)
+        results += bench_textures(args.textures, args.texture_size, args.repeat, work_folder)
+    os.chdir(original_folder)
+
+report = {
+    'python': platform.python_version(),
+    'numpy': np.__version__,
+    'platform': platform.platform(),
+    'repeat': args.repeat,
+    'results': results,
+}
+if args.output:
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+else:
+    json.dump(report, sys.stdout, indent=1)
+    print()
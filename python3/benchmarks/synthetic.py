@@ -0,0 +1,97 @@
+import argparse
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+from lib.parse_3db import Animation, Keyframe, KeyframeMesh, LazyPool, Material, Model, dequantize_vertices
+from lib.write_3db import save_3db, write_3db
+
+# Everything in the file format is addressed with u16 indices and counts
+MAX_U16 = 0xffff
+
+@dataclass
+class SyntheticSpec:
+    # Vertices per mesh
+    vertices: int = 500
+    # Keyframes per object
+    keyframes: int = 64
+    objects: int = 1
+    meshes_per_object: int = 2
+    animations_per_object: int = 4
+    shadows: int = 1
+    seed: int = 0
+
+    @property
+    def name(self) -> str:
+        return f'synthetic-v{self.vertices}-k{self.keyframes}-o{self.objects}'
+
+# Builds a model with the structure of the game files. Every keyframe gets its own vertex pool,
+# triangles, texture coordinates and brightness are shared by all keyframes of a mesh.
+# Materials are named synthetic_<n> and don't resolve to any texture.
+# The vertex pools are generated when they are accessed, so huge models don't have to fit into memory
+def synthetic_model(spec: SyntheticSpec) -> Model:
+    mesh_count = spec.objects * spec.meshes_per_object
+    vertex_pool_count = mesh_count * spec.keyframes
+    if not 3 <= spec.vertices <= MAX_U16:
+        raise ValueError(f'Vertex count must be between 3 and {MAX_U16}')
+    if vertex_pool_count > MAX_U16:
+        raise ValueError(f'{vertex_pool_count} vertex pools don\'t fit into the u16 pool table')
+    animation_count = min(spec.animations_per_object, spec.keyframes)
+
+    rng = np.random.default_rng(spec.seed)
+    materials = [Material(f'synthetic_{mesh}', f'synthetic_{mesh}.tga') for mesh in range(mesh_count)]
+
+    # Keyframe k of mesh m uses vertex pool m * keyframes + k, the other pools are indexed by mesh
+    keyframes = []
+    for obj in range(spec.objects):
+        for keyframe in range(spec.keyframes):
+            meshes = []
+            for obj_mesh in range(spec.meshes_per_object):
+                mesh = obj * spec.meshes_per_object + obj_mesh
+                meshes.append(KeyframeMesh(mesh, 1, mesh, mesh, mesh * spec.keyframes + keyframe, mesh))
+            keyframes.append(Keyframe(meshes))
+
+    # The keyframes of each object are split evenly between its animations
+    objects = {}
+    animations = []
+    for obj in range(spec.objects):
+        objects[f'object_{obj}'] = list(range(len(animations), len(animations) + animation_count))
+        splits = np.array_split(np.arange(spec.keyframes) + obj * spec.keyframes, animation_count)
+        for animation, frames in enumerate(splits):
+            animations.append(Animation(f'object_{obj}_animation_{animation}', frames.tolist()))
+
+    triangle_count = min(spec.vertices, MAX_U16 // 3)
+    triangle_data = [rng.integers(0, spec.vertices, triangle_count * 3).astype('<u2') for _ in range(mesh_count)]
+    texture_coordinates_data = [rng.random((spec.vertices, 2), dtype=np.float32) for _ in range(mesh_count)]
+    brightness_data = [rng.integers(0, 256, spec.vertices).astype(np.uint8) for _ in range(mesh_count)]
+    shadow_data = list(rng.integers(0, 256, (spec.shadows, 32, 32)).astype(np.uint8))
+
+    # Each mesh is a random point cloud that drifts a little further every keyframe
+    bases = [rng.integers(0x1000, 0xf000, (spec.vertices, 3)) for _ in range(mesh_count)]
+    drifts = [rng.integers(-8, 9, (spec.vertices, 3)) for _ in range(mesh_count)]
+
+    def vertices(pool: int) -> np.ndarray:
+        mesh, keyframe = divmod(pool, spec.keyframes)
+        return dequantize_vertices(np.clip(bases[mesh] + drifts[mesh] * keyframe, 0, MAX_U16))
+
+    return Model('synthetic', spec.name, materials, keyframes, objects, animations, triangle_data,
+                 texture_coordinates_data, LazyPool(vertex_pool_count, vertices, weak=True), brightness_data, shadow_data)
+
+def synthetic_3db(spec: SyntheticSpec) -> bytes:
+    return write_3db(synthetic_model(spec))
+
+# Writes stress test files, e.g. python -m benchmarks.synthetic huge.3db --vertices 20000 --keyframes 4000 --objects 4
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.synthetic', description='Generate a synthetic .3db file')
+    parser.add_argument('output')
+    parser.add_argument('--vertices', type=int, default=SyntheticSpec.vertices, help='vertices per mesh')
+    parser.add_argument('--keyframes', type=int, default=SyntheticSpec.keyframes, help='keyframes per object')
+    parser.add_argument('--objects', type=int, default=SyntheticSpec.objects)
+    parser.add_argument('--meshes', type=int, default=SyntheticSpec.meshes_per_object, help='meshes per object')
+    parser.add_argument('--seed', type=int, default=SyntheticSpec.seed)
+    args = parser.parse_args()
+
+    spec = SyntheticSpec(args.vertices, args.keyframes, args.objects, args.meshes, seed=args.seed)
+    save_3db(synthetic_model(spec), args.output)
+    print(f'Wrote {args.output} ({os.path.getsize(args.output) / (1024 * 1024):.1f} MB)')
@@ -0,0 +1,96 @@
+import argparse
+import os
+import sys
+
+from lib.catalog import AssetCatalog, CATALOG_NAME
+from lib.images import write_images
+from lib.parse_3db import load_3db, scan_3db
+
+parser = argparse.ArgumentParser(description='Inspect .3db headers and query a catalog of them')
+parser.add_argument('--db', default=CATALOG_NAME, help=f'catalog file (default: {CATALOG_NAME})')
+commands = parser.add_subparsers(dest='command', required=True)
+
+inspect_parser = commands.add_parser('inspect', help='print the header of .3db files without reading their pools')
+inspect_parser.add_argument('files', nargs='+')
+
+images_parser = commands.add_parser('images', help='write the shadows and cube maps of .3db files as PNGs, nothing else is decoded')
+images_parser.add_argument('files', nargs='+')
+images_parser.add_argument('-o', '--output', default='.', help='output folder (default: current folder)')
+
+scan_parser = commands.add_parser('scan', help='add the .3db files below a folder to the catalog, only changed files are read again')
+scan_parser.add_argument('folder')
+scan_parser.add_argument('-g', '--glob', dest='patterns', action='append',
+                         help="files to scan, relative to the folder (default: '**/*.3db', can be repeated)")
+
+files_parser = commands.add_parser('files', help='list the cataloged files')
+
+material_parser = commands.add_parser('material', help='objects that use a material')
+material_parser.add_argument('name')
+
+objects_parser = commands.add_parser('objects', help='files containing objects matching a name (SQL LIKE pattern)')
+objects_parser.add_argument('pattern')
+
+animations_parser = commands.add_parser('animations', help='animations matching a name (SQL LIKE pattern), or the largest ones')
+animations_parser.add_argument('pattern', nargs='?')
+animations_parser.add_argument('--largest', type=int, default=10, help='number of animations to list without a pattern')
+
+args = parser.parse_args()
+
+if args.command == 'inspect':
+    for path in args.files:
+        header = scan_3db(path)
+        layout = header.layout
+        print(f'{path}: {header.name} ({header.db_version})')
+        print(f'  {len(header.keyframes)} keyframes, {int(layout.vertex_counts.sum())} vertices in {len(layout.vertex_counts)} pools, '
+              f'{len(layout.triangle_counts)} triangle pools, {len(layout.texture_coordinate_counts)} texture coordinate pools, '
+              f'{layout.shadow_count} shadows, {len(layout.cube_maps)} cube maps')
+        print('  materials:')
+        for material in header.materials:
+            print(f'    {material.name} ({material.texture_path})')
+        print('  objects:')
+        for object_name, animation_idxs in header.objects.items():
+            names = ', '.join(header.animations[animation_idx].name for animation_idx in animation_idxs if animation_idx < len(header.animations))
+            print(f'    {object_name}: {names}')
+        print('  animations:')
+        for animation in header.animations:
+            print(f'    {animation.name}: {len(animation.keyframes)} frames')
+    sys.exit(0)
+
+if args.command == 'images':
+    os.makedirs(args.output, exist_ok=True)
+    for path in args.files:
+        name = os.path.basename(path).removesuffix('.3db')
+        for output in write_images(load_3db(path), name, args.output):
+            print(output)
+    sys.exit(0)
+
+try:
+    catalog = AssetCatalog(args.db)
+except ValueError as e:
+    print(e, file=sys.stderr)
+    sys.exit(1)
+
+with catalog:
+    if args.command == 'scan':
+        summary = catalog.refresh(args.folder, args.patterns)
+        for path, error in summary.failed:
+            print(f'Failed: {path}: {error}', file=sys.stderr)
+        print(f'Scanned {len(summary.scanned)} files, {summary.unchanged} unchanged, {len(summary.removed)} removed, '
+              f'{len(summary.failed)} failed')
+        sys.exit(1 if summary.failed else 0)
+    elif args.command == 'files':
+        for path, name, size, keyframes in catalog.files():
+            print(f'{path}\t{name}\t{size}\t{keyframes}')
+    elif args.command == 'material':
+        for path, object_name in catalog.objects_using_material(args.name):
+            print(f'{path}\t{object_name}')
+    elif args.command == 'objects':
+        for path, object_name in catalog.find_objects(args.pattern):
+            print(f'{path}\t{object_name}')
+    elif args.command == 'animations':
+        if args.pattern is None:
+            animations = catalog.largest_animations(args.largest)
+        else:
+            animations = catalog.find_animations(args.pattern)
+        for path, animation_name, frames in animations:
+            print(f'{path}\t{animation_name}\t{frames}')
@@ -0,0 +1,199 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from gltflib import Accessor, AccessorType, BufferTarget, ComponentType, Sparse, SparseIndices, SparseValues
+
+from lib.buffers import BinaryBuffers
+from lib.profiling import Profiler, NO_PROFILER
+
+# Largest value of a SHORT morph delta, larger deltas are stored as floats
+MAX_SHORT = 0x7fff
+# Largest index of an UNSIGNED_SHORT index accessor, 0xffff is reserved for primitive restart
+MAX_SHORT_INDEX = 0xfffe
+
+# Number of frames that are transformed and written at once, which bounds the temporary arrays of long animations
+FRAME_CHUNK_SIZE = 64
+
+# Target and byte stride of every buffer view
+VIEW_LAYOUTS: Dict[str, Tuple[Optional[int], Optional[int]]] = {
+    'vertices': (BufferTarget.ARRAY_BUFFER.value, 12),
+    'uvs': (BufferTarget.ARRAY_BUFFER.value, 8),
+    'indices': (BufferTarget.ELEMENT_ARRAY_BUFFER.value, None),
+    'ain': (None, None),
+    'aout': (None, None),
+    # Quantized VEC3s are padded to 8 bytes, attributes have to be 4-byte aligned
+    'positions': (BufferTarget.ARRAY_BUFFER.value, 8),
+    'deltas': (BufferTarget.ARRAY_BUFFER.value, 8),
+    'quvs': (BufferTarget.ARRAY_BUFFER.value, 4),
+    # Views of sparse accessors can't have a target or stride
+    'sparse_indices': (None, None),
+    'sparse_values': (None, None),
+}
+
+# Per-component min and max over the second to last axis, e.g. one pair per frame for an (frames, n, 3) array
+def bounds(values: np.ndarray):
+    if values.shape[-2] == 0:
+        zeros = np.zeros(values.shape[:-2] + values.shape[-1:])
+        return zeros.tolist(), zeros.tolist()
+    return values.min(axis=-2).tolist(), values.max(axis=-2).tolist()
+
+# Encodes arrays into the buffer views of VIEW_LAYOUTS and collects the glTF accessors reading them. Every add method
+# returns the indices of the accessors it created. Buffer views are created when they are first written to,
+# so unused ones are left out
+class AccessorWriter:
+    def __init__(self, buffers: BinaryBuffers, profiler: Profiler = NO_PROFILER):
+        self.buffers = buffers
+        self.profiler = profiler
+        self.accessors: List[Accessor] = []
+        # view name -> index of the buffer view
+        self.views: Dict[str, int] = {}
+        # Byte size of the elements of every index accessor
+        self.index_sizes = set()
+
+    def view(self, view_name: str) -> int:
+        if view_name not in self.views:
+            self.views[view_name] = self.buffers.add_view(view_name, *VIEW_LAYOUTS[view_name])
+        return self.views[view_name]
+
+    def _add(self, accessor: Accessor) -> int:
+        self.accessors.append(accessor)
+        return len(self.accessors) - 1
+
+    # One FLOAT VEC3 accessor per frame of (frames, n, 3) vertices
+    def add_vertices(self, vertices: np.ndarray) -> List[int]:
+        mins, maxs = bounds(vertices)
+        data_start = self.buffers.append(self.view('vertices'), vertices.astype('<f4'))
+        self.profiler.count('vertices', vertices.shape[0] * vertices.shape[1])
+        return [self._add(Accessor(bufferView=self.view('vertices'), byteOffset=data_start + frame * vertices.shape[1] * 12,
+                                   componentType=ComponentType.FLOAT.value, count=vertices.shape[1],
+                                   type=AccessorType.VEC3.value, min=mins[frame], max=maxs[frame]))
+                for frame in range(len(vertices))]
+
+    # Same as add_vertices for (frames, n, 3) integer vertices, written as dtype padded to 4 components
+    def add_quantized_vertices(self, vertices: np.ndarray, view_name: str, dtype, component_type: int) -> List[int]:
+        mins, maxs = bounds(vertices)
+        padded = np.zeros(vertices.shape[:2] + (4,), dtype=dtype)
+        padded[..., :3] = vertices
+        data_start = self.buffers.append(self.view(view_name), padded)
+        self.profiler.count('vertices', vertices.shape[0] * vertices.shape[1])
+        return [self._add(Accessor(bufferView=self.view(view_name), byteOffset=data_start + frame * vertices.shape[1] * 8,
+                                   componentType=component_type, count=vertices.shape[1],
+                                   type=AccessorType.VEC3.value, min=mins[frame], max=maxs[frame]))
+                for frame in range(len(vertices))]
+
+    # Morph deltas of (frames, n, 3) vertices, one accessor per frame. Quantized deltas are SHORT if all of a frame's
+    # deltas fit and floats otherwise. With sparse_deltas a frame is stored as a sparse accessor holding only the
+    # vertices that move more than tolerance if that takes less space than its dense deltas
+    def add_deltas(self, deltas: np.ndarray, quantized: bool, sparse_deltas: bool, tolerance: float) -> List[int]:
+        if quantized:
+            fits = np.all(np.abs(deltas.reshape(len(deltas), -1)) <= MAX_SHORT, axis=1)
+        else:
+            fits = np.zeros(len(deltas), dtype=bool)
+        moving = np.abs(deltas).max(axis=2) > tolerance
+        sparse = np.zeros(len(deltas), dtype=bool)
+        if sparse_deltas:
+            # Sparse elements are a u16 index and an unpadded value
+            dense_sizes = np.where(fits, 8, 12) * deltas.shape[1]
+            sparse_sizes = moving.sum(axis=1) * np.where(fits, 2 + 6, 2 + 12)
+            sparse = sparse_sizes < dense_sizes
+        accessor_indices = [None] * len(deltas)
+        for frame in np.flatnonzero(sparse):
+            accessor_indices[frame] = self.add_sparse_delta(deltas[frame], moving[frame], fits[frame])
+
+        short = ~sparse & fits
+        if short.any():
+            for frame, accessor_idx in zip(np.flatnonzero(short),
+                                           self.add_quantized_vertices(deltas[short], 'deltas', '<i2', ComponentType.SHORT.value)):
+                accessor_indices[frame] = accessor_idx
+        dense_float = ~sparse & ~fits
+        if dense_float.any():
+            for frame, accessor_idx in zip(np.flatnonzero(dense_float), self.add_vertices(deltas[dense_float])):
+                accessor_indices[frame] = accessor_idx
+        return accessor_indices
+
+    # Vertices that don't move keep the implicit zero of an accessor without buffer view
+    def add_sparse_delta(self, delta: np.ndarray, moving: np.ndarray, short: bool) -> int:
+        moved = np.flatnonzero(moving)
+        mins, maxs = bounds(np.where(moving[:, np.newaxis], delta, 0))
+        component_type = ComponentType.SHORT.value if short else ComponentType.FLOAT.value
+        sparse = None
+        if len(moved) > 0:
+            # Vertex counts are u16 in the file, so the indices always fit into UNSIGNED_SHORT
+            indices_start = self.buffers.append(self.view('sparse_indices'), moved.astype('<u2'))
+            values_start = self.buffers.append(self.view('sparse_values'), delta[moved].astype('<i2' if short else '<f4'))
+            sparse = Sparse(count=len(moved),
+                            indices=SparseIndices(bufferView=self.view('sparse_indices'), byteOffset=indices_start,
+                                                  componentType=ComponentType.UNSIGNED_SHORT.value),
+                            values=SparseValues(bufferView=self.view('sparse_values'), byteOffset=values_start))
+        self.profiler.count('vertices', len(moved))
+        self.profiler.count('sparse_morph_targets')
+        return self._add(Accessor(componentType=component_type, count=len(delta), type=AccessorType.VEC3.value,
+                                  min=mins, max=maxs, sparse=sparse))
+
+    # One VEC2 accessor per (n, 2) array. Quantized arrays within [-1, 1] are stored as normalized SHORT, which is also
+    # valid for the morph targets using them, all others as FLOAT
+    def add_texture_coordinates(self, texture_coordinates: List[np.ndarray], quantized: bool) -> List[int]:
+        accessor_indices = [None] * len(texture_coordinates)
+        float_pools = list(range(len(texture_coordinates)))
+        if quantized:
+            in_range = [len(uvs) == 0 or np.abs(uvs).max() <= 1.0 for uvs in texture_coordinates]
+            float_pools = [pool for pool, fits in enumerate(in_range) if not fits]
+            for pool, (uvs, fits) in enumerate(zip(texture_coordinates, in_range)):
+                if fits:
+                    data_start = self.buffers.append(self.view('quvs'), np.round(uvs * MAX_SHORT).astype('<i2'))
+                    accessor_indices[pool] = self._add(Accessor(bufferView=self.view('quvs'), byteOffset=data_start,
+                                                                componentType=ComponentType.SHORT.value, normalized=True,
+                                                                count=len(uvs), type=AccessorType.VEC2.value))
+        if not float_pools:
+            return accessor_indices
+        data_start = self.buffers.append(self.view('uvs'), np.concatenate([texture_coordinates[pool] for pool in float_pools]))
+        for pool in float_pools:
+            uvs = texture_coordinates[pool]
+            accessor_indices[pool] = self._add(Accessor(bufferView=self.view('uvs'), byteOffset=data_start,
+                                                        componentType=ComponentType.FLOAT.value, count=len(uvs),
+                                                        type=AccessorType.VEC2.value))
+            data_start += uvs.nbytes
+        return accessor_indices
+
+    # u32 triangle indices, quantized ones are stored as UNSIGNED_SHORT where they fit
+    def add_indices(self, indices: np.ndarray, quantized: bool) -> int:
+        component_type = ComponentType.UNSIGNED_INT.value
+        if quantized and (len(indices) == 0 or indices.max() <= MAX_SHORT_INDEX):
+            indices = indices.astype('<u2')
+            component_type = ComponentType.UNSIGNED_SHORT.value
+        self.index_sizes.add(indices.dtype.itemsize)
+        indices_start = self.buffers.append(self.view('indices'), indices)
+        return self._add(Accessor(bufferView=self.view('indices'), byteOffset=indices_start, componentType=component_type,
+                                  count=len(indices), type=AccessorType.SCALAR.value))
+
+    # Input of an animation sampler, the time of every frame in seconds
+    def add_times(self, times: np.ndarray) -> int:
+        data_start = self.buffers.append(self.view('ain'), times.astype('<f4'))
+        return self._add(Accessor(bufferView=self.view('ain'), byteOffset=data_start, componentType=ComponentType.FLOAT.value,
+                                  count=len(times), type=AccessorType.SCALAR.value, min=[times.min()], max=[times.max()]))
+
+    # Output of a morph target weight sampler in which every frame shows its active target at full weight and every other
+    # target at 0. Dense weights store all target_count weights of every frame, sparse ones only the non-zero weights
+    # over an implicit all-zero output
+    def add_weights(self, active_targets: np.ndarray, target_count: int, dense: bool) -> int:
+        frame_count = len(active_targets)
+        if dense:
+            # Rows are a multiple of 4 bytes long, so the chunks are written back to back
+            for chunk_start in range(0, frame_count, FRAME_CHUNK_SIZE):
+                chunk_targets = active_targets[chunk_start:chunk_start + FRAME_CHUNK_SIZE]
+                weights = np.zeros((len(chunk_targets), target_count), dtype='<f4')
+                weights[np.arange(len(chunk_targets)), chunk_targets] = 1.0
+                chunk_start_byte = self.buffers.append(self.view('aout'), weights)
+                if chunk_start == 0:
+                    data_start = chunk_start_byte
+            return self._add(Accessor(bufferView=self.view('aout'), byteOffset=data_start, componentType=ComponentType.FLOAT.value,
+                                      count=frame_count * target_count, type=AccessorType.SCALAR.value))
+        sparse_indices = np.arange(frame_count) * target_count + active_targets
+        indices_start = self.buffers.append(self.view('aout'), sparse_indices.astype('<u4'))
+        values_start = self.buffers.append(self.view('aout'), np.ones(frame_count, dtype='<f4'))
+        sparse = Sparse(count=frame_count,
+                        indices=SparseIndices(bufferView=self.view('aout'), byteOffset=indices_start,
+                                              componentType=ComponentType.UNSIGNED_INT.value),
+                        values=SparseValues(bufferView=self.view('aout'), byteOffset=values_start))
+        return self._add(Accessor(componentType=ComponentType.FLOAT.value, count=frame_count * target_count,
+                                  type=AccessorType.SCALAR.value, sparse=sparse))
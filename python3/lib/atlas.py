@@ -0,0 +1,94 @@
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image as PILImage
+
+# Every texture is surrounded by this many pixels of its own edge, so filtering and mipmaps don't blend neighbours
+ATLAS_PADDING = 4
+# Texture coordinates this far outside [0, 1] still count as inside, they sample the padding
+UV_RANGE_TOLERANCE = 1e-3
+
+@dataclass
+class AtlasRegion:
+    # Position and size of the texture in the atlas, without the padding
+    x: int
+    y: int
+    width: int
+    height: int
+
+@dataclass
+class TextureAtlas:
+    path: str
+    width: int
+    height: int
+    # texture name -> region
+    regions: Dict[str, AtlasRegion]
+
+    # Maps (n, 2) texture coordinates of a texture to the atlas. Like the textures, the atlas has its origin at the top left.
+    # Without translate they are only scaled to the size of the region, for coordinates that are added to others
+    def remap(self, texture_name: str, texture_coordinates: np.ndarray, translate: bool = True) -> np.ndarray:
+        region = self.regions[texture_name]
+        scale = np.array([region.width / self.width, region.height / self.height], dtype=np.float32)
+        if not translate:
+            return (texture_coordinates * scale).astype(np.float32)
+        offset = np.array([region.x / self.width, region.y / self.height], dtype=np.float32)
+        return (texture_coordinates * scale + offset).astype(np.float32)
+
+# True if a texture sampled with these coordinates can be moved into an atlas, which can't repeat it
+def fits_atlas(texture_coordinates: np.ndarray) -> bool:
+    return len(texture_coordinates) == 0 or (texture_coordinates.min() >= -UV_RANGE_TOLERANCE and
+                                             texture_coordinates.max() <= 1 + UV_RANGE_TOLERANCE)
+
+# Shelf packing of (width, height) rectangles into rows of the given width, the highest rectangles first.
+# Returns the position of every rectangle and the height of the rows
+def pack_shelves(sizes: List[Tuple[int, int]], width: int) -> Tuple[List[Tuple[int, int]], int]:
+    positions = [None] * len(sizes)
+    x, y, row_height = 0, 0, 0
+    for index in sorted(range(len(sizes)), key=lambda index: (-sizes[index][1], -sizes[index][0], index)):
+        rect_width, rect_height = sizes[index]
+        if x + rect_width > width:
+            x, y, row_height = 0, y + row_height, 0
+        positions[index] = (x, y)
+        x += rect_width
+        row_height = max(row_height, rect_height)
+    return positions, y + row_height
+
+def next_power_of_two(value: int) -> int:
+    return 1 << max(value - 1, 0).bit_length()
+
+# Packs the rectangles into the smallest power of two sized atlas any shelf width gives, the squarer one on ties.
+# Returns the position of every rectangle and the size of the atlas
+def pack_rectangles(sizes: List[Tuple[int, int]]) -> Tuple[List[Tuple[int, int]], int, int]:
+    best = None
+    width = next_power_of_two(max(width for width, _ in sizes))
+    while True:
+        positions, height = pack_shelves(sizes, width)
+        height = next_power_of_two(height)
+        candidate = (width * height, max(width, height), positions, width, height)
+        if best is None or candidate[:2] < best[:2]:
+            best = candidate
+        if width >= sum(width for width, _ in sizes):
+            break
+        width *= 2
+    return best[2:]
+
+# Packs the given textures (texture name -> source image path) into a single RGBA PNG at path
+def build_atlas(texture_paths: Dict[str, str], path: str, padding: int = ATLAS_PADDING) -> TextureAtlas:
+    names = list(texture_paths)
+    pixels = [np.asarray(PILImage.open(texture_paths[name]).convert('RGBA')) for name in names]
+    padded = [np.pad(image, ((padding, padding), (padding, padding), (0, 0)), mode='edge') for image in pixels]
+    positions, width, height = pack_rectangles([(image.shape[1], image.shape[0]) for image in padded])
+
+    atlas = np.zeros((height, width, 4), dtype=np.uint8)
+    regions = {}
+    for name, image, padded_image, (x, y) in zip(names, pixels, padded, positions):
+        atlas[y:y + padded_image.shape[0], x:x + padded_image.shape[1]] = padded_image
+        regions[name] = AtlasRegion(x + padding, y + padding, image.shape[1], image.shape[0])
+
+    # Write to a temporary file first, like the textures
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    PILImage.fromarray(atlas).save(temp_path, format='PNG')
+    os.replace(temp_path, path)
+    return TextureAtlas(path, width, height, regions)
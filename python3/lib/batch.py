@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from lib.parse_3db import load_3db
+from lib.export import export_to_gltf
+from lib.build_cache import BuildManifest, build_key
+from lib.model_cache import load_3db_cached
+from lib.textures import DEFAULT_TEXTURE_ROOT, TextureCache
+from lib.profiling import Profiler, merge_reports, write_report
+
+# Written into the output folder when profiling, next to the <name>_profile.json of every converted file
+BATCH_PROFILE_NAME = 'batch_profile.json'
+
+# One texture cache per process, output folder and texture root, shared by all files the process converts
+_texture_caches: Dict[Tuple[str, str], TextureCache] = {}
+
+def shared_texture_cache(output_folder: str, texture_root: str = DEFAULT_TEXTURE_ROOT) -> TextureCache:
+    if (output_folder, texture_root) not in _texture_caches:
+        _texture_caches[output_folder, texture_root] = TextureCache(output_folder, texture_root=texture_root)
+    return _texture_caches[output_folder, texture_root]
+
+@dataclass
+class ConversionResult:
+    model_path: str
+    # Size of the input file in bytes
+    size: int
+    seconds: float
+    error: Optional[str] = None
+    # Build key and written files, recorded in the build manifest
+    key: Optional[str] = None
+    outputs: List[str] = field(default_factory=list)
+    # Up to date according to the build manifest, nothing was converted
+    skipped: bool = False
+    # Profiler report, when profiling
+    profile: Optional[Dict] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+@dataclass
+class BatchSummary:
+    results: List[ConversionResult]
+    seconds: float
+
+    @property
+    def failed(self) -> List[ConversionResult]:
+        return [result for result in self.results if not result.ok]
+
+    @property
+    def converted(self) -> List[ConversionResult]:
+        return [result for result in self.results if result.ok and not result.skipped]
+
+    @property
+    def skipped(self) -> List[ConversionResult]:
+        return [result for result in self.results if result.skipped]
+
+    @property
+    def total_size(self) -> int:
+        return sum(result.size for result in self.converted)
+
+    def report(self) -> str:
+        converted = len(self.converted)
+        files_per_second = converted / self.seconds if self.seconds > 0 else 0.0
+        megabytes = self.total_size / (1024 * 1024)
+        megabytes_per_second = megabytes / self.seconds if self.seconds > 0 else 0.0
+        return (f'Converted {converted}/{len(self.results)} files ({megabytes:.1f} MB, {len(self.skipped)} up to date) '
+                f'in {self.seconds:.2f}s: {files_per_second:.2f} files/s, {megabytes_per_second:.2f} MB/s')
+
+# Converts a single file, unless its build key still matches previous_key.
+# With profile set, the phases of the conversion are written to <name>_profile.json in the output folder.
+# With model_cache set, the model is loaded through the parsed-model cache files in that folder.
+# Textures are looked up in texture_root and converted into texture_folder (default: the output folder).
+# Never raises, failures are returned in the result so one bad file doesn't abort a batch
+def convert_file(model_path: str, output_folder: str, settings: Optional[Dict] = None,
+                 previous_key: Optional[str] = None, profile: bool = False,
+                 model_cache: Optional[str] = None, texture_root: str = DEFAULT_TEXTURE_ROOT,
+                 texture_folder: Optional[str] = None) -> ConversionResult:
+    settings = settings or {}
+    profiler = Profiler(enabled=profile)
+    start = time.perf_counter()
+    try:
+        size = os.path.getsize(model_path)
+        key = build_key(model_path, settings, texture_root)
+        if key == previous_key:
+            return ConversionResult(model_path, size, time.perf_counter() - start, key=key, skipped=True)
+        name = os.path.basename(model_path).removesuffix('.3db')
+        profiler.start()
+        try:
+            if model_cache is not None:
+                model = load_3db_cached(model_path, model_cache, profiler)
+            else:
+                model = load_3db(model_path, profiler)
+            texture_cache = shared_texture_cache(texture_folder or output_folder, texture_root)
+            outputs = export_to_gltf(model, name, output_folder, texture_cache=texture_cache, profiler=profiler, **settings)
+        finally:
+            profiler.stop()
+        if profile:
+            profiler.write(os.path.join(output_folder, name + '_profile.json'))
+    except Exception:
+        return ConversionResult(model_path, 0, time.perf_counter() - start, traceback.format_exc())
+    return ConversionResult(model_path, size, time.perf_counter() - start, key=key, outputs=outputs,
+                            profile=profiler.report() if profile else None)
+
+# Converts all model_paths into output_folder using a pool of worker processes. settings are passed to
+# export_to_gltf. Files whose build key matches the manifest of the output folder are skipped unless force is set.
+# workers=1 converts everything in the current process. profile writes a report per converted file
+# and their sum to batch_profile.json. model_cache is a folder of parsed-model cache files shared by all workers.
+# texture_root is the asset folder with the m256, m128, ... texture folders. Textures that are embedded into the .glb
+# files are converted into a temporary folder shared by all workers, so the output folder only gets the .glb files
+def convert_batch(model_paths: List[str], output_folder: str, workers: Optional[int] = None,
+                  settings: Optional[Dict] = None, force: bool = False, profile: bool = False,
+                  model_cache: Optional[str] = None, texture_root: str = DEFAULT_TEXTURE_ROOT) -> BatchSummary:
+    os.makedirs(output_folder, exist_ok=True)
+    manifest = BuildManifest(output_folder)
+    previous_keys = {model_path: None if force else manifest.key(model_path) for model_path in model_paths}
+    start = time.perf_counter()
+    texture_folder = tempfile.mkdtemp(prefix='diggles-textures-') if (settings or {}).get('embed_textures') else None
+    results = []
+    try:
+        if workers == 1:
+            for model_path in model_paths:
+                results.append(convert_file(model_path, output_folder, settings, previous_keys[model_path], profile, model_cache,
+                                            texture_root, texture_folder))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(convert_file, model_path, output_folder, settings, previous_keys[model_path], profile,
+                                           model_cache, texture_root, texture_folder): model_path
+                           for model_path in model_paths}
+                for future in as_completed(futures):
+                    try:
+                        results.append(future.result())
+                    except Exception:
+                        # The worker itself died (e.g. out of memory), not just the conversion
+                        results.append(ConversionResult(futures[future], 0, 0.0, traceback.format_exc()))
+            results.sort(key=lambda result: result.model_path)
+    finally:
+        if texture_folder is not None:
+            shutil.rmtree(texture_folder, ignore_errors=True)
+
+    for result in results:
+        if result.ok and not result.skipped:
+            manifest.record(result.model_path, result.key, result.outputs)
+    manifest.save()
+    if profile:
+        write_report(merge_reports([result.profile for result in results if result.profile is not None]),
+                     os.path.join(output_folder, BATCH_PROFILE_NAME))
+    return BatchSummary(results, time.perf_counter() - start)
@@ -0,0 +1,216 @@
+import os
+import shutil
+import struct
+from dataclasses import dataclass, field
+from typing import BinaryIO, List, Optional, Tuple
+
+import numpy as np
+from gltflib import Buffer, BufferView
+
+GLB_MAGIC = 0x46546C67
+GLB_VERSION = 2
+GLB_JSON_CHUNK = 0x4E4F534A
+GLB_BIN_CHUNK = 0x004E4942
+
+def padding(length: int, alignment: int = 4) -> int:
+    return (alignment - length % alignment) % alignment
+
+@dataclass
+class ViewData:
+    name: str
+    target: Optional[int] = None
+    byte_stride: Optional[int] = None
+    data: bytearray = field(default_factory=bytearray)
+    # Set when streaming, the data is then written to this file instead of being kept in data.
+    # write_gltf also sets it for the .part files it writes the other views to
+    path: Optional[str] = None
+    file: Optional[BinaryIO] = None
+    length: int = 0
+    # Set when alignment bytes were inserted between two appends
+    padded: bool = False
+    # EXT_meshopt_compression settings once the data was replaced by its compressed form, see compress_view
+    compression: Optional[dict] = None
+
+# Size of a compressed view once it is decoded
+def uncompressed_length(view: ViewData) -> int:
+    return view.compression['count'] * view.compression['byteStride']
+
+# The buffer views of one export. They are either written as one .bin file per view next to a .gltf,
+# or packed back to back into the binary chunk of a .glb.
+# With a stream_prefix every view is written to <stream_prefix>_<view name>.bin.part as it is appended to,
+# so only offsets are kept in memory. write_gltf then just closes and renames these files, write_glb copies them.
+# Outputs only replace existing files once they are complete, call close(discard=True) if the export fails
+class BinaryBuffers:
+    def __init__(self, stream_prefix: Optional[str] = None):
+        self.views: List[ViewData] = []
+        self.stream_prefix = stream_prefix
+
+    def add_view(self, name: str, target: Optional[int] = None, byte_stride: Optional[int] = None) -> int:
+        view = ViewData(name, target, byte_stride)
+        if self.stream_prefix is not None:
+            view.path = f'{self.stream_prefix}_{name}.bin.part'
+            view.file = open(view.path, 'wb')
+        self.views.append(view)
+        return len(self.views) - 1
+
+    # Appends data (bytes or a numpy array) to a view and returns its byte offset inside the view.
+    # Every append starts 4-byte aligned, which satisfies the alignment of all glTF component types
+    def append(self, view: int, data) -> int:
+        view_data = self.views[view]
+        if isinstance(data, np.ndarray):
+            data = np.ascontiguousarray(data).reshape(-1).view(np.uint8)
+        alignment = bytes(padding(view_data.length))
+        offset = view_data.length + len(alignment)
+        view_data.padded = view_data.padded or len(alignment) > 0
+        if view_data.file is not None:
+            view_data.file.write(alignment)
+            view_data.file.write(data)
+        else:
+            view_data.data.extend(alignment)
+            view_data.data.extend(data)
+        view_data.length = offset + len(data)
+        return offset
+
+    def byte_length(self, view: int) -> int:
+        return self.views[view].length
+
+    def read_view(self, view: int) -> bytes:
+        view_data = self.views[view]
+        if view_data.file is not None:
+            view_data.file.flush()
+            with open(view_data.path, 'rb') as f:
+                return f.read()
+        return bytes(view_data.data)
+
+    # Replaces the data of a view with its EXT_meshopt_compression encoding. The view keeps its uncompressed size,
+    # which is then backed by a fallback buffer without data
+    def compress_view(self, view: int, compressed: bytes, mode: str, byte_stride: int):
+        view_data = self.views[view]
+        view_data.compression = {'byteStride': byte_stride, 'count': view_data.length // byte_stride, 'mode': mode}
+        if view_data.file is not None:
+            view_data.file.seek(0)
+            view_data.file.truncate()
+            view_data.file.write(compressed)
+        else:
+            view_data.data = bytearray(compressed)
+        view_data.length = len(compressed)
+
+    # BufferView of a view whose data is stored at byte_offset in buffer. Compressed views point to their
+    # uncompressed range in the fallback buffer, the extension to the compressed data
+    def _buffer_view(self, view: ViewData, buffer: int, byte_offset: int, fallback: int, fallback_offset: int) -> BufferView:
+        if view.compression is None:
+            return BufferView(buffer=buffer, byteOffset=byte_offset, byteLength=view.length,
+                              target=view.target, byteStride=view.byte_stride)
+        extension = {'buffer': buffer, 'byteOffset': byte_offset, 'byteLength': view.length, **view.compression}
+        return BufferView(buffer=fallback, byteOffset=fallback_offset, byteLength=uncompressed_length(view),
+                          target=view.target, byteStride=view.byte_stride,
+                          extensions={'EXT_meshopt_compression': extension})
+
+    # Buffer without data that backs the uncompressed size of all compressed views, or None if there are none
+    def _fallback_buffer(self) -> Optional[Buffer]:
+        compressed = [uncompressed_length(view) for view in self.views if view.compression is not None]
+        if not compressed:
+            return None
+        return Buffer(byteLength=sum(length + padding(length) for length in compressed),
+                      extensions={'EXT_meshopt_compression': {'fallback': True}})
+
+    # Closes the stream files, and deletes the ones that weren't moved to their output yet if discard is set
+    def close(self, discard: bool = False):
+        for view in self.views:
+            if view.file is not None:
+                view.file.close()
+                view.file = None
+            if discard and view.path is not None and os.path.exists(view.path):
+                os.remove(view.path)
+
+    # One buffer per view, each stored in name_<view name>.bin
+    def gltf_buffers(self, name: str) -> Tuple[List[Buffer], List[BufferView]]:
+        buffers = []
+        buffer_views = []
+        fallback_offset = 0
+        for index, view in enumerate(self.views):
+            buffers.append(Buffer(byteLength=view.length, uri=f'{name}_{view.name}.bin'))
+            buffer_views.append(self._buffer_view(view, index, 0, len(self.views), fallback_offset))
+            if view.compression is not None:
+                fallback_offset += uncompressed_length(view) + padding(uncompressed_length(view))
+        fallback = self._fallback_buffer()
+        if fallback is not None:
+            buffers.append(fallback)
+        return buffers, buffer_views
+
+    # Writes every view to name_<view name>.bin and model_json, which must describe gltf_buffers(name), to gltf_path.
+    # All files are written as .part files first and only replace the outputs once all of them are complete, so a
+    # failure never leaves new .bin files next to an old .gltf. Returns the paths of the .gltf and the .bin files
+    def write_gltf(self, name: str, output_path: str, gltf_path: str, model_json: str) -> List[str]:
+        paths = []
+        for view in self.views:
+            path = os.path.join(output_path, f'{name}_{view.name}.bin')
+            if view.path is not None:
+                view.file.close()
+                view.file = None
+            else:
+                # Set first, so close(discard=True) also removes a half written file
+                view.path = path + '.part'
+                with open(view.path, 'wb') as f:
+                    f.write(view.data)
+            paths.append(path)
+        temp_path = gltf_path + '.part'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(model_json)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        for view, path in zip(self.views, paths):
+            os.replace(view.path, path)
+            view.path = None
+        os.replace(temp_path, gltf_path)
+        return [gltf_path] + paths
+
+    # A single buffer holding all views, each starting 4-byte aligned
+    def glb_buffers(self) -> Tuple[List[Buffer], List[BufferView]]:
+        buffer_views = []
+        offset = 0
+        fallback_offset = 0
+        for view in self.views:
+            buffer_views.append(self._buffer_view(view, 0, offset, 1, fallback_offset))
+            offset += view.length + padding(view.length)
+            if view.compression is not None:
+                fallback_offset += uncompressed_length(view) + padding(uncompressed_length(view))
+        fallback = self._fallback_buffer()
+        return [Buffer(byteLength=offset)] + ([fallback] if fallback is not None else []), buffer_views
+
+    # Writes header, JSON chunk and the binary chunk in one pass. model_json must describe glb_buffers()
+    def write_glb(self, path: str, model_json: str):
+        temp_path = path + '.part'
+        try:
+            self._write_glb(temp_path, model_json)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        os.replace(temp_path, path)
+
+    def _write_glb(self, path: str, model_json: str):
+        json_chunk = model_json.encode('utf-8')
+        json_chunk += b' ' * padding(len(json_chunk))
+        bin_length = sum(view.length + padding(view.length) for view in self.views)
+        total_length = 12 + 8 + len(json_chunk) + (8 + bin_length if bin_length > 0 else 0)
+        with open(path, 'wb') as f:
+            f.write(struct.pack('<III', GLB_MAGIC, GLB_VERSION, total_length))
+            f.write(struct.pack('<II', len(json_chunk), GLB_JSON_CHUNK))
+            f.write(json_chunk)
+            if bin_length == 0:
+                return
+            f.write(struct.pack('<II', bin_length, GLB_BIN_CHUNK))
+            for view in self.views:
+                if view.path is not None:
+                    view.file.close()
+                    view.file = None
+                    with open(view.path, 'rb') as stream:
+                        shutil.copyfileobj(stream, f, 1024 * 1024)
+                    os.remove(view.path)
+                else:
+                    f.write(view.data)
+                f.write(bytes(padding(view.length)))
@@ -0,0 +1,65 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+from lib.parse_3db import scan_3db
+from lib.textures import DEFAULT_TEXTURE_ROOT, find_texture
+
+MANIFEST_NAME = '.build_manifest.json'
+# Bump when the exporter output changes for the same settings, so existing manifests are invalidated.
+# 2: sparse morph deltas, deduplicated keyframes and texture lookup in the input folder
+CACHE_VERSION = 2
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Key of everything a conversion depends on: the .3db content, the content of every texture it resolves to
+# and the exporter settings. Only the header of the model is decoded to find its materials
+def build_key(model_path: str, settings: Dict, texture_root: str = DEFAULT_TEXTURE_ROOT) -> str:
+    model = scan_3db(model_path)
+
+    textures = {}
+    for material in model.materials:
+        texture_path = find_texture(material.name, texture_root)
+        textures[material.name] = [texture_path, hash_file(texture_path)] if texture_path is not None else None
+
+    key = {
+        'version': CACHE_VERSION,
+        'model': hash_file(model_path),
+        'textures': textures,
+        'settings': settings,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+# Persistent record of the key and output files of every conversion in an output folder
+class BuildManifest:
+    def __init__(self, output_folder: str):
+        self.path = os.path.join(output_folder, MANIFEST_NAME)
+        self.entries = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                # A broken manifest only means everything is rebuilt
+                self.entries = {}
+
+    def key(self, model_path: str) -> Optional[str]:
+        entry = self.entries.get(os.path.abspath(model_path))
+        if entry is None or not all(os.path.isfile(output) for output in entry['outputs']):
+            return None
+        return entry['key']
+
+    def record(self, model_path: str, key: str, outputs: List[str]):
+        self.entries[os.path.abspath(model_path)] = {'key': key, 'outputs': [os.path.abspath(output) for output in outputs]}
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,191 @@
+import os
+import sqlite3
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from lib.files import find_models
+from lib.parse_3db import Header, scan_3db
+
+CATALOG_NAME = 'catalog.sqlite'
+# Bump when the tables change, older catalogs are then rebuilt from scratch
+CATALOG_VERSION = 1
+# The tables of SCHEMA, the only ones a rebuild drops
+CATALOG_TABLES = ['files', 'materials', 'animations', 'objects', 'object_animations', 'object_materials']
+
+SCHEMA = '''
+CREATE TABLE files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    db_version TEXT NOT NULL,
+    name TEXT NOT NULL,
+    keyframes INTEGER NOT NULL,
+    triangle_pools INTEGER NOT NULL,
+    texture_coordinate_pools INTEGER NOT NULL,
+    vertex_pools INTEGER NOT NULL,
+    brightness_pools INTEGER NOT NULL,
+    vertices INTEGER NOT NULL,
+    shadows INTEGER NOT NULL,
+    cube_maps INTEGER NOT NULL
+);
+CREATE TABLE materials (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    material_index INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    texture_path TEXT NOT NULL
+);
+CREATE TABLE animations (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    animation_index INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    frames INTEGER NOT NULL
+);
+CREATE TABLE objects (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    animations INTEGER NOT NULL
+);
+CREATE TABLE object_animations (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    object_name TEXT NOT NULL,
+    animation_index INTEGER NOT NULL
+);
+-- Materials used by the keyframes of an object's animations
+CREATE TABLE object_materials (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    object_name TEXT NOT NULL,
+    material_index INTEGER NOT NULL
+);
+CREATE INDEX materials_name ON materials(name);
+CREATE INDEX animations_name ON animations(name);
+CREATE INDEX objects_name ON objects(name);
+'''
+
+@dataclass
+class RefreshSummary:
+    scanned: List[str]
+    unchanged: int
+    removed: List[str]
+    # (path, error message) of files that couldn't be scanned
+    failed: List[Tuple[str, str]]
+
+# SQLite catalog of the headers of an asset tree. refresh only rescans files whose modification time or size
+# changed since they were cataloged, the pools of a file are never read.
+# Raises ValueError for an existing database that isn't a catalog
+class AssetCatalog:
+    def __init__(self, path: str = CATALOG_NAME):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != CATALOG_VERSION:
+            tables = [table for table, in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            if version == 0 and tables:
+                self.connection.close()
+                raise ValueError(f'{path} is not an asset catalog, it already has the tables {", ".join(tables)}')
+            with self.connection:
+                for table in CATALOG_TABLES:
+                    self.connection.execute(f'DROP TABLE IF EXISTS {table}')
+                self.connection.executescript(SCHEMA)
+                self.connection.execute(f'PRAGMA user_version = {CATALOG_VERSION}')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    # Scans the files below root that match any of the glob patterns. Files that were cataloged below root
+    # but don't exist anymore are removed
+    def refresh(self, root: str, patterns: Optional[List[str]] = None) -> RefreshSummary:
+        paths = [os.path.abspath(path) for path in find_models(root, patterns or ['**/*.3db'])]
+        known = {path: (mtime_ns, size) for path, mtime_ns, size in self.connection.execute('SELECT path, mtime_ns, size FROM files')}
+        summary = RefreshSummary([], 0, [], [])
+        with self.connection:
+            for path in paths:
+                stat = os.stat(path)
+                if known.get(path) == (stat.st_mtime_ns, stat.st_size):
+                    summary.unchanged += 1
+                    continue
+                self._remove(path)
+                try:
+                    header = scan_3db(path)
+                except Exception as e:
+                    summary.failed.append((path, f'{type(e).__name__}: {e}'))
+                    continue
+                self._insert(path, stat, header)
+                summary.scanned.append(path)
+
+            scanned_root = os.path.join(os.path.abspath(root), '')
+            existing = set(paths)
+            for path in known:
+                if path.startswith(scanned_root) and path not in existing:
+                    self._remove(path)
+                    summary.removed.append(path)
+        return summary
+
+    def _remove(self, path: str):
+        self.connection.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def _insert(self, path: str, stat: os.stat_result, header: Header):
+        layout = header.layout
+        cursor = self.connection.execute(
+            'INSERT INTO files (path, mtime_ns, size, db_version, name, keyframes, triangle_pools, texture_coordinate_pools, '
+            'vertex_pools, brightness_pools, vertices, shadows, cube_maps) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (path, stat.st_mtime_ns, stat.st_size, header.db_version, header.name, len(header.keyframes),
+             len(layout.triangle_counts), len(layout.texture_coordinate_counts), len(layout.vertex_counts),
+             len(layout.brightness_counts), int(layout.vertex_counts.sum()), layout.shadow_count, len(layout.cube_maps)))
+        file_id = cursor.lastrowid
+
+        self.connection.executemany('INSERT INTO materials VALUES (?, ?, ?, ?)',
+                                    [(file_id, index, material.name, material.texture_path) for index, material in enumerate(header.materials)])
+        self.connection.executemany('INSERT INTO animations VALUES (?, ?, ?, ?)',
+                                    [(file_id, index, animation.name, len(animation.keyframes)) for index, animation in enumerate(header.animations)])
+        self.connection.executemany('INSERT INTO objects VALUES (?, ?, ?)',
+                                    [(file_id, object_name, len(animation_idxs)) for object_name, animation_idxs in header.objects.items()])
+        self.connection.executemany('INSERT INTO object_animations VALUES (?, ?, ?)',
+                                    [(file_id, object_name, animation_idx) for object_name, animation_idxs in header.objects.items()
+                                     for animation_idx in animation_idxs])
+
+        object_materials = []
+        for object_name, animation_idxs in header.objects.items():
+            material_idxs = {keyframe_mesh.material
+                             for animation_idx in animation_idxs if animation_idx < len(header.animations)
+                             for keyframe_idx in header.animations[animation_idx].keyframes if keyframe_idx < len(header.keyframes)
+                             for keyframe_mesh in header.keyframes[keyframe_idx].meshes}
+            object_materials.extend((file_id, object_name, material_idx) for material_idx in sorted(material_idxs))
+        self.connection.executemany('INSERT INTO object_materials VALUES (?, ?, ?)', object_materials)
+
+    def files(self) -> List[Tuple[str, str, int, int]]:
+        return self.connection.execute('SELECT path, name, size, keyframes FROM files ORDER BY path').fetchall()
+
+    # (path, object name) of every object whose keyframes use a material of this name
+    def objects_using_material(self, material_name: str) -> List[Tuple[str, str]]:
+        return self.connection.execute(
+            'SELECT DISTINCT files.path, object_materials.object_name FROM object_materials '
+            'JOIN files ON files.id = object_materials.file_id '
+            'JOIN materials ON materials.file_id = object_materials.file_id AND materials.material_index = object_materials.material_index '
+            'WHERE materials.name = ? ORDER BY files.path, object_materials.object_name', (material_name,)).fetchall()
+
+    # (path, animation name, frames) of the animations with the most frames
+    def largest_animations(self, limit: int = 10) -> List[Tuple[str, str, int]]:
+        return self.connection.execute(
+            'SELECT files.path, animations.name, animations.frames FROM animations JOIN files ON files.id = animations.file_id '
+            'ORDER BY animations.frames DESC, files.path, animations.name LIMIT ?', (limit,)).fetchall()
+
+    # (path, object name) of the objects with this name, % and _ work as SQL wildcards
+    def find_objects(self, pattern: str) -> List[Tuple[str, str]]:
+        return self.connection.execute(
+            'SELECT files.path, objects.name FROM objects JOIN files ON files.id = objects.file_id '
+            'WHERE objects.name LIKE ? ORDER BY files.path, objects.name', (pattern,)).fetchall()
+
+    # (path, animation name, frames) of the animations with this name, % and _ work as SQL wildcards
+    def find_animations(self, pattern: str) -> List[Tuple[str, str, int]]:
+        return self.connection.execute(
+            'SELECT files.path, animations.name, animations.frames FROM animations JOIN files ON files.id = animations.file_id '
+            'WHERE animations.name LIKE ? ORDER BY files.path, animations.name', (pattern,)).fetchall()
@@ -1,198 +1,529 @@
-import struct
 from gltflib import (
-    GLTF, GLTFModel, Asset, Scene, Node, Mesh, Primitive, Attributes, Buffer, BufferView, Accessor, AccessorType,
-    BufferTarget, ComponentType, FileResource, PBRMetallicRoughness, Texture, Image, Material, TextureInfo, Sampler, Animation, AnimationSampler, Channel, Target)
+    GLTFModel, Asset, Scene, Node, Mesh, Primitive, Attributes, ComponentType, PBRMetallicRoughness, Texture, Image, Material,
+    TextureInfo, Sampler, Animation, AnimationSampler, Channel, Target)
 
-from lib.parse_3db import Model
-from lib.math_util import Vector3
+from lib.parse_3db import Model, pool_as_array, quantize_vertices
+from lib.math_util import Vector3, Vector3Array
 import os
-from PIL import Image as PILImage
+import tempfile
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from lib.textures import TextureCache, find_texture
+from lib.buffers import BinaryBuffers
+from lib.accessors import FRAME_CHUNK_SIZE, AccessorWriter
+from lib.profiling import Profiler, NO_PROFILER
+from lib.keyframes import analyze_keyframes
+from lib.meshopt import encode_buffer_view, optimize_mesh, require_meshoptimizer
+from lib.images import write_images
+from lib.atlas import TextureAtlas, build_atlas, fits_atlas
 
-def transform_vertex(v: Vector3) -> Vector3: 
-    # TODO: Check why scale and axis flip work the way they do. It looks good when importing the model in Blender.
-    scale = 100
-    # Flip Y-axis and Z-axis to match the glTF coordinate system
-    return Vector3((v.x - 0.5) * scale, - (v.y -0.5) * scale, - (v.z - 0.5) * scale)
+# Vertices are centered on the origin and scaled by 100, with the Y-axis and Z-axis flipped to match the glTF coordinate system.
+# TODO: Check why scale and axis flip work the way they do. It looks good when importing the model in Blender.
+VERTEX_CENTER = Vector3(0.5, 0.5, 0.5)
+VERTEX_SCALE = Vector3(100, -100, -100)
 
-def export_to_gltf(model: Model, name: str, output_path: str):
+# Maps an (n, 3) array of vertices in file coordinates to output coordinates: (v - VERTEX_CENTER) * VERTEX_SCALE
+def transform_vertices(vertices: np.ndarray) -> np.ndarray:
+    return ((Vector3Array(vertices) - VERTEX_CENTER) * VERTEX_SCALE).data
 
-    nodes = []
-    object_root_nodes = []
-    accessors = []
-    meshes = []
+# Maps the names of the objects to export to the indices of their animations to export.
+# objects and animations are lists of names, None selects all of them. Objects without any selected animation are left out
+def select_animations(model: Model, objects: Optional[List[str]] = None,
+                      animations: Optional[List[str]] = None) -> Dict[str, List[int]]:
+    if objects is not None:
+        unknown_objects = [object_name for object_name in objects if object_name not in model.objects]
+        if unknown_objects:
+            raise ValueError(f'Unknown objects {unknown_objects}, available: {list(model.objects)}')
+    if animations is not None:
+        animation_names = {animation.name for animation in model.animations}
+        unknown_animations = [animation_name for animation_name in animations if animation_name not in animation_names]
+        if unknown_animations:
+            raise ValueError(f'Unknown animations {unknown_animations}, available: {sorted(animation_names)}')
 
-    images = []
-    texture_resources = []
-    gltfsamplers = []
-    gltftextures = []  
-    materials = []
+    selected = {}
+    for object_name, animation_idxs in model.objects.items():
+        if objects is not None and object_name not in objects:
+            continue
+        if animations is not None:
+            animation_idxs = [animation_idx for animation_idx in animation_idxs if model.animations[animation_idx].name in animations]
+        if animation_idxs:
+            selected[object_name] = animation_idxs
+    if not selected and (objects is not None or animations is not None):
+        raise ValueError('None of the selected animations belongs to a selected object')
+    return selected
 
-    vertex_byte_array = bytearray()
-    uv_byte_array = bytearray()
-    index_byte_array = bytearray()
+# With quantize, positions keep the u16 values of the file and mesh nodes get this transform, which maps them
+# to the same coordinates transform_vertices produces: (u / 0xffff - 0.5) * 100, with Y and Z flipped
+QUANTIZED_TRANSLATION = [-50.0, 50.0, 50.0]
+QUANTIZED_SCALE = [100 / 0xffff, -100 / 0xffff, -100 / 0xffff]
 
-    animation_in_byte_array = bytearray()
-    animation_out_byte_array = bytearray()
-    gltf_animations = []
+# Settings of export_to_gltf, which takes them as keyword arguments
+@dataclass
+class ExportOptions:
+    # How the morph target weights of each animation are stored:
+    #   'sparse' only stores the single active target per frame, so the buffer grows linearly with the frame count
+    #   'dense' stores a weight for every morph target of the object in every frame
+    weight_encoding: str = 'sparse'
+    # 'gltf' (a .gltf with one .bin per buffer view and the textures next to it) or 'glb' (a single .glb with one binary chunk)
+    output_format: str = 'gltf'
+    # Also packs the PNGs into the .glb
+    embed_textures: bool = False
+    # Writes the buffer data to disk while it is produced instead of keeping it in memory
+    streaming: bool = False
+    # Only export these object and animation names (see select_animations). Only the pools and textures used by their
+    # keyframes are read and written, so a lazily loaded model never decodes the rest
+    objects: Optional[List[str]] = None
+    animations: Optional[List[str]] = None
+    # Stores the geometry with KHR_mesh_quantization: positions as the UNSIGNED_SHORT values of the file with the
+    # scale and offset moved into the mesh nodes, morph deltas as SHORT where they fit, texture coordinates within [-1, 1]
+    # as normalized SHORT and indices as UNSIGNED_SHORT where a mesh has few enough vertices
+    quantize: bool = False
+    # (needs the meshoptimizer package) Reorders the triangles of every mesh for the vertex cache and its vertices,
+    # including all morph targets, in the order the triangles use them, then compresses the geometry and animation buffer
+    # views with EXT_meshopt_compression
+    meshopt: bool = False
+    # Stores a morph target as a sparse accessor of the vertices that move more than delta_tolerance (in output units,
+    # the model spans 100) when that is smaller than its dense deltas. Vertices within the tolerance are then moved by 0,
+    # the default tolerance of 0 only leaves out vertices that don't move at all
+    sparse_deltas: bool = True
+    delta_tolerance: float = 0.0
+    # Shares one morph target between all frames of an object that show the same geometry, and frame_tolerance
+    # (in model units) drops frames that interpolating between the frames around them rebuilds, see analyze_keyframes
+    deduplicate_keyframes: bool = True
+    frame_tolerance: Optional[float] = None
+    # Also writes the shadows and cube maps of the model as PNGs next to the output, see write_images
+    images: bool = False
+    # Packs the textures of all materials whose texture coordinates stay within [0, 1] into <name>_atlas.png (embedded like
+    # the textures with embed_textures) with a single
+    # glTF material, remaps their texture coordinates into it and merges the meshes of an object using it into one primitive
+    atlas: bool = False
 
-    for [node_name, animation_idxs] in model.objects.items():
+    def validate(self):
+        if self.weight_encoding not in ('sparse', 'dense'):
+            raise ValueError(f'Unknown weight encoding: {self.weight_encoding}')
+        if self.output_format not in ('gltf', 'glb'):
+            raise ValueError(f'Unknown output format: {self.output_format}')
+        if self.embed_textures and self.output_format != 'glb':
+            raise ValueError('Textures can only be embedded into glb files')
+        if self.meshopt:
+            require_meshoptimizer()
+
+# Indices of the materials used by the keyframes of the selected animations
+def used_materials(model: Model, selected_animations: Dict[str, List[int]]) -> List[int]:
+    return sorted({keyframe_mesh.material
+                   for animation_idxs in selected_animations.values()
+                   for animation_idx in animation_idxs
+                   for keyframe_index in model.animations[animation_idx].keyframes
+                   for keyframe_mesh in model.keyframes[keyframe_index].meshes})
+
+# Packs the textures of the given materials whose texture coordinates stay within [0, 1] in all selected keyframes into
+# <name>_atlas.png in output_path. Returns the texture name of every packed material, by material index, and the atlas
+# (None if no texture fits)
+def build_model_atlas(model: Model, name: str, output_path: str, selected_animations: Dict[str, List[int]],
+                      material_idxs: List[int], texture_root: str) -> Tuple[Dict[int, str], Optional[TextureAtlas]]:
+    material_texture_coordinates = {}
+    for animation_idxs in selected_animations.values():
+        for animation_idx in animation_idxs:
+            for keyframe_index in model.animations[animation_idx].keyframes:
+                for keyframe_mesh in model.keyframes[keyframe_index].meshes:
+                    material_texture_coordinates.setdefault(keyframe_mesh.material, set()).add(keyframe_mesh.texture_coordinates)
+    atlas_sources = {}
+    atlas_textures = {}
+    for material_idx in material_idxs:
+        texture_name = model.materials[material_idx].name
+        source_path = find_texture(texture_name, texture_root)
+        if source_path is not None and all(fits_atlas(pool_as_array(model.texture_coordinates_data[pool], '<f4', 2))
+                                           for pool in material_texture_coordinates[material_idx]):
+            atlas_sources[texture_name] = source_path
+            atlas_textures[material_idx] = texture_name
+    if not atlas_sources:
+        return atlas_textures, None
+    return atlas_textures, build_atlas(atlas_sources, os.path.join(output_path, name + '_atlas.png'))
+
+def concatenated(arrays: List[np.ndarray]) -> np.ndarray:
+    return arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+
+# Builds the glTF scene of the selected objects of a model: nodes, meshes, morph targets, animations and materials,
+# with their data written through an AccessorWriter.
+# Every pool referenced by the keyframes is written once and its accessor shared between all meshes
+# and morph targets using it. Position targets are deltas, so they are keyed by (pool, base pool).
+# A primitive stores the concatenated pools of its meshes, so pools are referred to by tuples with the pool of
+# every mesh. Texture coordinate pools come with the atlas texture they are remapped into (or None) and whether they
+# are translated into its region (see TextureAtlas.remap), triangle pools with the vertex count of their mesh.
+# With meshopt the vertices are reordered per triangle pools, so all per-vertex keys also include the
+# triangle pools of their primitive (order key), which is None otherwise
+class GltfBuilder:
+    def __init__(self, model: Model, options: ExportOptions, writer: AccessorWriter, profiler: Profiler = NO_PROFILER,
+                 atlas_textures: Optional[Dict[int, str]] = None, texture_atlas: Optional[TextureAtlas] = None):
+        self.model = model
+        self.options = options
+        self.writer = writer
+        self.profiler = profiler
+        # Materials whose texture is packed into texture_atlas, by material index
+        self.atlas_textures = atlas_textures or {}
+        self.texture_atlas = texture_atlas
+
+        self.nodes = []
+        self.object_root_nodes = []
+        self.meshes = []
+        self.animations = []
+        self.images = []
+        self.samplers = []
+        self.textures = []
+        self.materials = []
+        # material index -> glTF material index, and the PNG of every glTF material
+        self.material_indices = {}
+        self.material_textures = []
+
+        self.position_accessors = {}
+        self.delta_accessors = {}
+        self.texture_coordinate_accessors = {}
+        self.index_accessors = {}
+        # triangle pools -> (optimized indices, old index of every new vertex)
+        self.mesh_orders = {}
+
+    # A glTF material is created for the atlas and for every other material whose texture exists,
+    # texture_paths are the PNGs of texture_materials (None where the texture is missing)
+    def assign_materials(self, texture_materials: List[int], texture_paths: List[Optional[str]]):
+        if self.texture_atlas is not None:
+            self.material_indices.update((material_idx, 0) for material_idx in self.atlas_textures)
+            self.material_textures.append(self.texture_atlas.path)
+        for material_idx, texture_path in zip(texture_materials, texture_paths):
+            if texture_path is not None:
+                self.material_indices[material_idx] = len(self.material_textures)
+                self.material_textures.append(texture_path)
+
+    # Adds the images, samplers, textures and materials of assign_materials. Embedded textures are copied into the
+    # buffers, so their PNGs have to be complete, the others are referenced relative to output_path
+    def add_materials(self, buffers: BinaryBuffers, output_path: str, embed_textures: bool):
+        for texture_path in self.material_textures:
+            if embed_textures:
+                with open(texture_path, 'rb') as f:
+                    image_view = buffers.add_view(f'image{len(self.images)}')
+                    buffers.append(image_view, f.read())
+                self.images.append(Image(bufferView=image_view, mimeType='image/png'))
+            else:
+                self.images.append(Image(uri=os.path.relpath(texture_path, output_path).replace(os.sep, '/')))
+
+            # TODO: this adds a new sampler, texture and material per image texture, all with default values. There may be a cleaner way to handle this.
+            current_idx = len(self.textures)
+            self.samplers.append(Sampler())
+            self.textures.append(Texture(sampler=current_idx, source=current_idx))
+            pbr = PBRMetallicRoughness(baseColorTexture=TextureInfo(index=current_idx))
+            self.materials.append(Material(pbrMetallicRoughness=pbr))
+
+    def reordered(self, values: np.ndarray, order_key: Optional[tuple]) -> np.ndarray:
+        return values if order_key is None else values[self.mesh_orders[order_key][1]]
+
+    # Vertex pools in output coordinates, or as the quantized values of the file
+    def vertex_pool(self, pools: tuple, order_key: Optional[tuple]) -> np.ndarray:
+        if self.options.quantize:
+            vertices = [quantize_vertices(pool_as_array(self.model.vertex_data[pool], np.float64, 3)).astype(np.int32) for pool in pools]
+        else:
+            vertices = [transform_vertices(pool_as_array(self.model.vertex_data[pool], np.float32, 3)) for pool in pools]
+        return self.reordered(concatenated(vertices), order_key)
+
+    def texture_coordinate_pool(self, pools: tuple, order_key: Optional[tuple]) -> np.ndarray:
+        texture_coordinates = []
+        for pool, atlas_texture, translate in pools:
+            uvs = pool_as_array(self.model.texture_coordinates_data[pool], '<f4', 2)
+            texture_coordinates.append(uvs if atlas_texture is None else self.texture_atlas.remap(atlas_texture, uvs, translate))
+        return self.reordered(concatenated(texture_coordinates), order_key)
+
+    # The indices of each mesh follow the vertices of the meshes before it
+    def triangle_pool(self, pools: tuple) -> np.ndarray:
+        indices = []
+        vertex_offset = 0
+        for pool, vertex_count in pools:
+            indices.append(pool_as_array(self.model.triangle_data[pool], '<u4') + np.uint32(vertex_offset))
+            vertex_offset += vertex_count
+        return concatenated(indices)
+
+    def position_accessor(self, vertex_pools: tuple, order_key: Optional[tuple], vertices: np.ndarray) -> int:
+        key = (vertex_pools, order_key)
+        if key not in self.position_accessors:
+            if self.options.quantize:
+                self.position_accessors[key], = self.writer.add_quantized_vertices(vertices[np.newaxis], 'positions', '<u2',
+                                                                                   ComponentType.UNSIGNED_SHORT.value)
+            else:
+                self.position_accessors[key], = self.writer.add_vertices(vertices[np.newaxis])
+        return self.position_accessors[key]
+
+    # Writes the delta encoded (frames, n, 3) vertices of a primitive against its base mesh, keys has one key per frame
+    def add_delta_accessors(self, deltas: np.ndarray, keys: List[tuple]):
+        tolerance = self.options.delta_tolerance * 0xffff / 100 if self.options.quantize else self.options.delta_tolerance
+        accessor_indices = self.writer.add_deltas(deltas, self.options.quantize, self.options.sparse_deltas, tolerance)
+        self.delta_accessors.update(zip(keys, accessor_indices))
+
+    def add_texture_coordinate_accessors(self, pool_indices, order_key: Optional[tuple]):
+        new_pools = [pool for pool in dict.fromkeys(pool_indices) if (pool, order_key) not in self.texture_coordinate_accessors]
+        if not new_pools:
+            return
+        texture_coordinates = [self.texture_coordinate_pool(pool, order_key) for pool in new_pools]
+        accessor_indices = self.writer.add_texture_coordinates(texture_coordinates, self.options.quantize)
+        self.texture_coordinate_accessors.update(((pool, order_key), accessor_idx) for pool, accessor_idx in zip(new_pools, accessor_indices))
+
+    def index_accessor(self, triangle_pools: tuple) -> int:
+        if triangle_pools not in self.index_accessors:
+            if self.options.meshopt:
+                indices = self.mesh_orders[triangle_pools][0]
+            else:
+                indices = self.triangle_pool(triangle_pools)
+            self.index_accessors[triangle_pools] = self.writer.add_indices(indices, self.options.quantize)
+        return self.index_accessors[triangle_pools]
+
+    # Adds an object node with a mesh node per primitive, the morph targets of all frames of its animations and the animations
+    def add_object(self, node_name: str, animation_idxs: List[int]):
         base_node = Node(name=node_name, children=[])
-        base_node_idx = len(nodes)
-        nodes.append(base_node)
-        object_root_nodes.append(base_node_idx)
-        
+        self.object_root_nodes.append(len(self.nodes))
+        self.nodes.append(base_node)
+
+        # Get first keyframe of this object and use it to set base meshes
+        initial_keyframe = self.model.keyframes[self.model.animations[animation_idxs[0]].keyframes[0]]
+        # Meshes drawn as one primitive: all meshes using the atlas together, every other mesh on its own
+        atlas_meshes = [j for j, keyframe_mesh in enumerate(initial_keyframe.meshes) if keyframe_mesh.material in self.atlas_textures]
+        primitive_meshes = [atlas_meshes if j in atlas_meshes else [j]
+                            for j in range(len(initial_keyframe.meshes)) if j not in atlas_meshes[1:]]
+        # The texture coordinates of a mesh are remapped into the atlas texture of its base mesh in every frame
+        mesh_atlas_textures = [self.atlas_textures.get(keyframe_mesh.material) for keyframe_mesh in initial_keyframe.meshes]
+
+        with self.profiler.phase('base_meshes'):
+            base_meshes, base_vertices, order_keys = self.add_base_meshes(base_node, initial_keyframe, primitive_meshes, mesh_atlas_textures)
+
+        with self.profiler.phase('keyframe_analysis'):
+            analysis = analyze_keyframes(self.model, animation_idxs, self.options.deduplicate_keyframes, self.options.frame_tolerance)
+        self.profiler.count('duplicate_frames', analysis.duplicate_frames)
+        self.profiler.count('dropped_frames', analysis.dropped_frames)
+
+        with self.profiler.phase('morph_targets'):
+            target_keyframes = [self.model.keyframes[keyframe_idx] for keyframe_idx in analysis.targets]
+            for primitive_idx, mesh_idxs in enumerate(primitive_meshes):
+                self.add_morph_targets(base_meshes[primitive_idx], base_vertices[primitive_idx], order_keys[primitive_idx],
+                                       [initial_keyframe.meshes[j] for j in mesh_idxs], mesh_idxs, mesh_atlas_textures,
+                                       target_keyframes, analysis)
+                self.profiler.count('morph_targets', len(target_keyframes))
+
+        for animation_frames in analysis.animations:
+            with self.profiler.phase('animation_weights'):
+                sampler = self.add_weight_sampler(animation_frames, len(analysis.targets))
+            channels = [Channel(sampler=0, target=Target(node=mesh_node_idx, path="weights")) for mesh_node_idx in base_node.children]
+            self.animations.append(Animation(name=self.model.animations[animation_frames.animation].name,
+                                             channels=channels, samplers=[sampler]))
+
+    # Adds a mesh with a single primitive and its node for every group of meshes in primitive_meshes.
+    # Returns the meshes, their vertices and their order keys
+    def add_base_meshes(self, base_node: Node, initial_keyframe, primitive_meshes: List[List[int]],
+                        mesh_atlas_textures: List[Optional[str]]):
         base_meshes = []
         base_vertices = []
-        # Get first keyframe of this object and use it to set base meshes
-        initial_keyframe = model.keyframes[model.animations[animation_idxs[0]].keyframes[0]]
-        for keyframe_mesh in initial_keyframe.meshes:
-            vertices = [transform_vertex(p) for p in model.vertex_data[keyframe_mesh.vertices]]
+        order_keys = []
+        for mesh_idxs in primitive_meshes:
+            parts = [initial_keyframe.meshes[j] for j in mesh_idxs]
+            vertex_pools = tuple(part.vertices for part in parts)
+            texture_coordinate_pools = tuple((part.texture_coordinates, mesh_atlas_textures[j], True) for part, j in zip(parts, mesh_idxs))
+            triangle_pools = tuple((part.triangles, len(self.model.vertex_data[part.vertices])) for part in parts)
+            order_key = None
+            if self.options.meshopt:
+                order_key = triangle_pools
+                if order_key not in self.mesh_orders:
+                    self.mesh_orders[order_key] = optimize_mesh(self.triangle_pool(triangle_pools), sum(count for _, count in triangle_pools))
+            order_keys.append(order_key)
+
+            vertices = self.vertex_pool(vertex_pools, order_key)
             base_vertices.append(vertices)
-            mins = list(map(min, zip(*vertices)))
-            maxs = list(map(max, zip(*vertices)))
-            vertex_data_start = len(vertex_byte_array)
-            [vertex_byte_array.extend(struct.pack('fff', v.x, v.y, v.z)) for v in vertices]
-            vertex_accessor_idx = len(accessors)
-            accessors.append(Accessor(bufferView=0, byteOffset=vertex_data_start, componentType=ComponentType.FLOAT.value, count=len(vertices),
-                                type=AccessorType.VEC3.value, min=mins, max=maxs))
-            
-            texture_coordinates = model.texture_coordinates_data[keyframe_mesh.texture_coordinates]
-            texture_coords_start = len(uv_byte_array)
-            [uv_byte_array.extend(struct.pack('ff', uv.x, uv.y)) for uv in texture_coordinates]
-            texture_coords_accessors_index = len(accessors)
-            accessors.append(Accessor(bufferView=1, byteOffset=texture_coords_start, componentType=ComponentType.FLOAT.value, count=len(texture_coordinates),
-                                type=AccessorType.VEC2.value))
-        
-            base_indices = model.triangle_data[keyframe_mesh.triangles]
-            indices_start = len(index_byte_array)
-            [index_byte_array.extend(struct.pack('I', index)) for index in base_indices]  
-            indices_accessor_index = len(accessors)
-            accessors.append(Accessor(bufferView=2, byteOffset=indices_start, componentType=ComponentType.UNSIGNED_INT.value, count=len(base_indices),
-                                type=AccessorType.SCALAR.value))
-
-            mesh_index = len(meshes)
-            base_mesh = Mesh(primitives=[Primitive(attributes=Attributes(POSITION=vertex_accessor_idx, TEXCOORD_0=texture_coords_accessors_index), indices=indices_accessor_index, material=keyframe_mesh.material, targets=[])])
-            meshes.append(base_mesh)
+            vertex_accessor_idx = self.position_accessor(vertex_pools, order_key, vertices)
+
+            self.add_texture_coordinate_accessors([texture_coordinate_pools], order_key)
+            texture_coords_accessors_index = self.texture_coordinate_accessors[(texture_coordinate_pools, order_key)]
+
+            indices_accessor_index = self.index_accessor(triangle_pools)
+
+            mesh_index = len(self.meshes)
+            base_mesh = Mesh(primitives=[Primitive(attributes=Attributes(POSITION=vertex_accessor_idx, TEXCOORD_0=texture_coords_accessors_index),
+                                                   indices=indices_accessor_index, material=self.material_indices.get(parts[0].material), targets=[])])
+            self.meshes.append(base_mesh)
             base_meshes.append(base_mesh)
-            mesh_node_idx = len(nodes)
-            nodes.append(Node(name=node_name, mesh=mesh_index))
-            base_node.children.append(mesh_node_idx)
+            base_node.children.append(len(self.nodes))
+            if self.options.quantize:
+                self.nodes.append(Node(name=base_node.name, mesh=mesh_index, translation=QUANTIZED_TRANSLATION, scale=QUANTIZED_SCALE))
+            else:
+                self.nodes.append(Node(name=base_node.name, mesh=mesh_index))
+        return base_meshes, base_vertices, order_keys
 
-        overall_keyframe_count = sum([len(model.animations[animation_idx].keyframes) for animation_idx in animation_idxs])
-        keyframe_idx = 0
-        for animation_idx in animation_idxs:
-            animation = model.animations[animation_idx]
-            keyframes_in_animation = [kf for index, kf in enumerate(model.keyframes) if index in animation.keyframes]
-            keyframe_len = len(keyframes_in_animation)
-            # Invert structure from "list of frames, with list of all meshes" to "list of meshes with list of its frames"
-            meshes_with_frames = [[keyframes_in_animation[i].meshes[j] for i in range(len(keyframes_in_animation))] for j in range(len(keyframes_in_animation[0].meshes))]
-            for obj_mesh_index, frames in enumerate(meshes_with_frames):            
-                for frame in frames:
-                    vertices = [transform_vertex(p) for p in model.vertex_data[frame.vertices]]
-                    vertices = [vertex - base_vertex for vertex, base_vertex in zip(vertices, base_vertices[obj_mesh_index])]
-                    mins = list(map(min, zip(*vertices)))
-                    maxs = list(map(max, zip(*vertices)))
-                    vertex_data_start = len(vertex_byte_array)
-                    [vertex_byte_array.extend(struct.pack('fff', v.x, v.y, v.z)) for v in vertices]
-                    vertex_accessor_idx = len(accessors)
-                    accessors.append(Accessor(bufferView=0, byteOffset=vertex_data_start, componentType=ComponentType.FLOAT.value, count=len(vertices),
-                                        type=AccessorType.VEC3.value, min=mins, max=maxs))
-                    
-                    texture_coordinates = model.texture_coordinates_data[frame.texture_coordinates]
-                    texture_coords_start = len(uv_byte_array)
-                    [uv_byte_array.extend(struct.pack('ff', uv.x, uv.y)) for uv in texture_coordinates]
-                    texture_coords_accessors_index = len(accessors)
-                    accessors.append(Accessor(bufferView=1, byteOffset=texture_coords_start, componentType=ComponentType.FLOAT.value, count=len(texture_coordinates),
-                                        type=AccessorType.VEC2.value))
-                    
-                    base_meshes[obj_mesh_index].primitives[0].targets.append(Attributes(POSITION=vertex_accessor_idx, TEXCOORD_0=texture_coords_accessors_index))
-            
-            # TODO: Method to get min & max is a lazy hack right now
-            ain_min = 1000000
-            ain_max = 0
-            a_in_byteOffset = len(animation_in_byte_array)
-            a_out_byteOffset = len(animation_out_byte_array)
-            for i in range(keyframe_len):
-                ain_val = i * 0.1 # TODO: assumes that each frame is 0.1 seconds long. Looks good but is just a guess.
-                if ain_val < ain_min: ain_min = ain_val
-                if ain_val > ain_max: ain_max = ain_val
-                animation_in_byte_array.extend(struct.pack('f', ain_val))
-                for j in range(overall_keyframe_count):
-                    if (keyframe_idx+i)==j:
-                        animation_out_byte_array.extend(struct.pack('f', 1.0))
-                    else:
-                        animation_out_byte_array.extend(struct.pack('f', 0.0))
-            accessor_a_in_idx = len(accessors)
-            accessors.append(Accessor(bufferView=3, byteOffset=a_in_byteOffset, componentType=ComponentType.FLOAT.value, count=keyframe_len,
-                                type=AccessorType.SCALAR.value, min=[ain_min], max=[ain_max]))
-            accessor_a_out_idx = len(accessors)
-            accessors.append(Accessor(bufferView=4, byteOffset=a_out_byteOffset, componentType=ComponentType.FLOAT.value, count=keyframe_len*(overall_keyframe_count),
-                                type=AccessorType.SCALAR.value))
-            channels = [Channel(sampler=0,target=Target(node=base_node.children[obj_mesh_index], path="weights")) for obj_mesh_index in range(len(meshes_with_frames))]
-            gltf_anim = Animation(name=animation.name,
-                            channels=channels,  
-                            samplers=[AnimationSampler(input=accessor_a_in_idx, output=accessor_a_out_idx)])
-            gltf_animations.append(gltf_anim)
-            keyframe_idx+=keyframe_len
-
-
-    for material in model.materials:
-        texture_name = material.name
-        # check if file exists in m256 or m128 asset folder folder, take the highest version
-        # TODO: make this check the other folders
-        possible_paths = [
-            "./assets/in/m256/",
-            "./assets/in/m128/",
-            "./assets/in/m064/",
-            "./assets/in/m032/"
-        ]
-        FILE_ENDING = ".tga"
-        for path_suffix in possible_paths:
-            full_path = os.path.join(path_suffix, texture_name + FILE_ENDING)
-            if os.path.isfile(full_path):
-                pillow_image = PILImage.open(full_path)
-                pillow_image = pillow_image.save("./assets/out/" + texture_name + ".png")
-                images.append(Image(uri=texture_name + ".png"))
-                texture_resources.append(FileResource(texture_name + ".png", basepath="./assets/out/"))
-                
-                # TODO: this adds a new sampler, texture and material per image texture, all with default values. There may be a cleaner way to handle this.
-                current_idx = len(gltftextures)
-                gltfsamplers.append(Sampler())
-                gltftextures.append(Texture(sampler=current_idx,source=current_idx))
-                pbr = PBRMetallicRoughness(baseColorTexture=TextureInfo(index=current_idx))
-                gltf_material = Material(pbrMetallicRoughness=pbr)
-                materials.append(gltf_material)
-                break
-
-    model = GLTFModel(
-        asset=Asset(version='2.0'),
-        scenes=[Scene(nodes=[idx for idx in object_root_nodes])],
-        nodes=nodes,
-        buffers=[Buffer(byteLength=len(vertex_byte_array), uri= name + '_vertices.bin'), 
-                 Buffer(byteLength=len(uv_byte_array), uri= name + '_uvs.bin'), 
-                 Buffer(byteLength=len(index_byte_array), uri=name + '_indices.bin'),
-                 Buffer(byteLength=len(animation_in_byte_array), uri=name + '_ain.bin'),
-                 Buffer(byteLength=len(animation_out_byte_array), uri=name + '_aout.bin')],
-        bufferViews=[BufferView(buffer=0, byteOffset=0, byteLength=len(vertex_byte_array), target=BufferTarget.ARRAY_BUFFER.value, byteStride=12),
-                     BufferView(buffer=1, byteOffset=0, byteLength=len(uv_byte_array), target=BufferTarget.ARRAY_BUFFER.value, byteStride=8),
-                     BufferView(buffer=2, byteOffset=0, byteLength=len(index_byte_array), target=BufferTarget.ELEMENT_ARRAY_BUFFER.value),
-                     BufferView(buffer=3, byteOffset=0, byteLength=len(animation_in_byte_array)),
-                     BufferView(buffer=4, byteOffset=0, byteLength=len(animation_out_byte_array))],
-        accessors=accessors,
-        meshes=meshes,
-        materials=materials,
-        samplers=gltfsamplers,
-        textures=gltftextures,
-        images=images,
-        animations=gltf_animations
-    )
-
-    resources = [FileResource(name + '_vertices.bin', data=vertex_byte_array),
-                 FileResource(name + '_uvs.bin', data=uv_byte_array),
-                 FileResource(name + '_indices.bin', data=index_byte_array),     
-                 FileResource(name + '_ain.bin', data=animation_in_byte_array),
-                 FileResource(name + '_aout.bin', data=animation_out_byte_array)]
-    resources.extend(texture_resources)
-    gltf = GLTF(model=model, resources=resources)
-    gltf.export_gltf(output_path + "/" + name + '_out.gltf')
+    # Adds a morph target for every target keyframe to the primitive of base_mesh, which draws the meshes mesh_idxs
+    # (base_parts in the initial keyframe) of every frame.
+    # Pools with the same content are replaced by the first of them, so they share their accessors
+    def add_morph_targets(self, base_mesh: Mesh, base_vertices: np.ndarray, order_key: Optional[tuple], base_parts,
+                          mesh_idxs: List[int], mesh_atlas_textures: List[Optional[str]], target_keyframes, analysis):
+        vertex_pools = [tuple(analysis.vertex_pools[keyframe.meshes[j].vertices] for j in mesh_idxs) for keyframe in target_keyframes]
+        # Target texture coordinates are added to those of the base mesh, which already moved them into the atlas region.
+        # Pools outside of the atlas keep the key of the base mesh pools, so both share their accessors
+        texture_coordinate_pools = [tuple((analysis.texture_coordinate_pools[keyframe.meshes[j].texture_coordinates], mesh_atlas_textures[j],
+                                           mesh_atlas_textures[j] is None)
+                                          for j in mesh_idxs) for keyframe in target_keyframes]
+        # All vertex pools of this primitive that were not written yet are transformed, delta encoded against
+        # the base mesh, bounded and written in chunks of FRAME_CHUNK_SIZE. They share the vertex count of the base mesh
+        base_pool = tuple(part.vertices for part in base_parts)
+        new_pools = [pool for pool in dict.fromkeys(vertex_pools) if (pool, base_pool, order_key) not in self.delta_accessors]
+        for chunk_start in range(0, len(new_pools), FRAME_CHUNK_SIZE):
+            chunk_pools = new_pools[chunk_start:chunk_start + FRAME_CHUNK_SIZE]
+            deltas = np.stack([self.vertex_pool(pool, order_key) for pool in chunk_pools]) - base_vertices
+            self.add_delta_accessors(deltas, [(pool, base_pool, order_key) for pool in chunk_pools])
+
+        self.add_texture_coordinate_accessors(texture_coordinate_pools, order_key)
+
+        for vertex_pool_idx, texture_coordinate_pool_idx in zip(vertex_pools, texture_coordinate_pools):
+            base_mesh.primitives[0].targets.append(Attributes(POSITION=self.delta_accessors[(vertex_pool_idx, base_pool, order_key)],
+                                                              TEXCOORD_0=self.texture_coordinate_accessors[(texture_coordinate_pool_idx, order_key)]))
+
+    # Sampler of the morph target weights of an animation, every kept frame shows its morph target at full weight
+    def add_weight_sampler(self, animation_frames, target_count: int) -> AnimationSampler:
+        # TODO: assumes that each frame is 0.1 seconds long. Looks good but is just a guess.
+        # Dropped frames leave gaps, the kept frames keep their time
+        times = np.array(animation_frames.frames, dtype=np.float64) * 0.1
+        input_idx = self.writer.add_times(times)
+        active_targets = np.array(animation_frames.targets, dtype=np.int64)
+        output_idx = self.writer.add_weights(active_targets, target_count, self.options.weight_encoding == 'dense')
+        return AnimationSampler(input=input_idx, output=output_idx)
+
+    # Quantized attributes and compressed views can't be read without their extensions
+    def extensions(self) -> Optional[List[str]]:
+        extensions = []
+        if self.options.quantize:
+            extensions.append('KHR_mesh_quantization')
+        if self.options.meshopt:
+            extensions.append('EXT_meshopt_compression')
+        return extensions or None
+
+    def gltf_model(self, gltf_buffers, buffer_views) -> GLTFModel:
+        extensions = self.extensions()
+        return GLTFModel(
+            extensionsUsed=extensions,
+            extensionsRequired=extensions,
+            asset=Asset(version='2.0'),
+            scenes=[Scene(nodes=list(self.object_root_nodes))],
+            nodes=self.nodes,
+            buffers=gltf_buffers,
+            bufferViews=buffer_views,
+            accessors=self.writer.accessors,
+            meshes=self.meshes,
+            materials=self.materials,
+            samplers=self.samplers,
+            textures=self.textures,
+            images=self.images,
+            animations=self.animations
+        )
+
+# Compresses the buffer views written by writer with EXT_meshopt_compression.
+# Indices are compressed as one triangle list when nothing was inserted between the meshes, otherwise as a
+# plain index sequence. Views mixing 16 and 32 bit indices or ending in half an element are kept as they are
+def compress_views(buffers: BinaryBuffers, writer: AccessorWriter, profiler: Profiler = NO_PROFILER):
+    for view_name, view_idx in writer.views.items():
+        view_data = buffers.views[view_idx]
+        if view_name == 'indices':
+            if len(writer.index_sizes) != 1:
+                continue
+            byte_stride = next(iter(writer.index_sizes))
+            mode = 'INDICES' if view_data.padded else 'TRIANGLES'
+        else:
+            byte_stride = view_data.byte_stride or 4
+            mode = 'ATTRIBUTES'
+        if view_data.length % byte_stride != 0:
+            continue
+        compressed = encode_buffer_view(buffers.read_view(view_idx), mode, byte_stride)
+        buffers.compress_view(view_idx, compressed, mode, byte_stride)
+        profiler.count(f'compressed_bytes/{view_name}', len(compressed))
+
+# Exports the selected objects and animations of a model to <name>_out.gltf or <name>_out.glb in output_path,
+# settings are the fields of ExportOptions. Returns the paths of all written files.
+# texture_cache converts the textures, pass one to share it between several exports. Its texture_root is where the
+# textures are looked up, the default one looks in ./assets/in and converts into output_path (a temporary folder
+# with embed_textures).
+# profiler records the time and memory of each phase and counts vertices, accessors, morph targets and buffer bytes.
+def export_to_gltf(model: Model, name: str, output_path: str, texture_cache: Optional[TextureCache] = None,
+                   profiler: Profiler = NO_PROFILER, **settings):
+    options = ExportOptions(**settings)
+    options.validate()
+
+    selected_animations = select_animations(model, options.objects, options.animations)
+    material_idxs = used_materials(model, selected_animations)
+
+    owns_texture_cache = texture_cache is None
+    # Embedded textures and the atlas are only read until they are copied into the .glb, so they are written to a
+    # temporary folder and the output folder only gets the .glb
+    temporary_folder = tempfile.TemporaryDirectory(prefix='diggles-textures-') if options.embed_textures else None
+    image_folder = temporary_folder.name if temporary_folder is not None else output_path
+    if owns_texture_cache:
+        texture_cache = TextureCache(image_folder)
+    if not options.streaming:
+        buffers = BinaryBuffers()
+    elif options.output_format == 'glb':
+        # Spooled next to the output and copied into the binary chunk at the end
+        buffers = BinaryBuffers(os.path.join(output_path, name + '_out'))
+    else:
+        # Streamed into .part files next to the final .bin files, which they replace at the end
+        buffers = BinaryBuffers(os.path.join(output_path, name))
+    # A failed export closes and deletes its stream files, and leaves the outputs of a previous export as they were
+    try:
+        atlas_textures = {}
+        texture_atlas = None
+        if options.atlas:
+            with profiler.phase('atlas'):
+                atlas_textures, texture_atlas = build_model_atlas(model, name, image_folder, selected_animations, material_idxs,
+                                                                  texture_cache.texture_root)
+                profiler.count('atlas_textures', len(atlas_textures))
+
+        # Start converting the textures right away, so they are encoded while the geometry is built
+        texture_materials = [material_idx for material_idx in material_idxs if material_idx not in atlas_textures]
+        texture_names = [model.materials[material_idx].name for material_idx in texture_materials]
+        with profiler.phase('textures'):
+            texture_paths = [texture_cache.request(texture_name) for texture_name in texture_names]
+        image_paths = write_images(model, name, output_path, profiler) if options.images else []
+
+        writer = AccessorWriter(buffers, profiler)
+        builder = GltfBuilder(model, options, writer, profiler, atlas_textures, texture_atlas)
+        builder.assign_materials(texture_materials, texture_paths)
+        for node_name, animation_idxs in selected_animations.items():
+            builder.add_object(node_name, animation_idxs)
+
+        if options.embed_textures:
+            # The PNGs have to be complete before they can be copied into the binary chunk
+            with profiler.phase('textures'):
+                texture_cache.wait(texture_names)
+        builder.add_materials(buffers, output_path, options.embed_textures)
+
+        profiler.count('objects', len(builder.object_root_nodes))
+        profiler.count('accessors', len(writer.accessors))
+        for buffer_view in buffers.views:
+            profiler.count(f'bytes/{buffer_view.name}', buffer_view.length)
+
+        if options.meshopt:
+            with profiler.phase('meshopt_compression'):
+                compress_views(buffers, writer, profiler)
+
+        # Building the glTF json and writing all files
+        with profiler.phase('serialize'):
+            if options.output_format == 'glb':
+                gltf_model = builder.gltf_model(*buffers.glb_buffers())
+                glb_path = os.path.join(output_path, name + '_out.glb')
+                buffers.write_glb(glb_path, gltf_model.to_json())
+                outputs = [glb_path]
+            else:
+                gltf_model = builder.gltf_model(*buffers.gltf_buffers(name))
+                gltf_path = os.path.join(output_path, name + '_out.gltf')
+                outputs = buffers.write_gltf(name, output_path, gltf_path, gltf_model.to_json())
+        with profiler.phase('textures'):
+            texture_cache.wait(texture_names)
+    except BaseException:
+        buffers.close(discard=True)
+        raise
+    finally:
+        if owns_texture_cache:
+            texture_cache.close()
+        if temporary_folder is not None:
+            temporary_folder.cleanup()
     print('Converted: ' + name)
+    if not options.embed_textures:
+        outputs += builder.material_textures
+    return outputs + image_paths
@@ -0,0 +1,12 @@
+import glob
+import os
+from typing import List
+
+# Returns all files below input_folder matching any of the glob patterns, e.g. '*.3db' or '**/*.3db'
+def find_models(input_folder: str, patterns: List[str]) -> List[str]:
+    model_paths = set()
+    for pattern in patterns:
+        for path in glob.glob(os.path.join(input_folder, pattern), recursive=True):
+            if os.path.isfile(path):
+                model_paths.add(os.path.normpath(path))
+    return sorted(model_paths)
@@ -0,0 +1,39 @@
+import os
+from typing import List
+
+import numpy as np
+from PIL import Image as PILImage
+
+from lib.parse_3db import Model, pool_as_array
+from lib.profiling import Profiler, NO_PROFILER
+
+SHADOW_SIZE = 32
+
+# All shadows of a model as one (count * 32, 32) grayscale array, the shadows stacked from top to bottom.
+# The shadows of an eagerly parsed model are consecutive views of the file, so this is only a copy for lazy pools
+def shadow_sheet(model: Model) -> np.ndarray:
+    shadows = [pool_as_array(shadow, 'u1').reshape(SHADOW_SIZE, SHADOW_SIZE) for shadow in model.shadow_data]
+    if not shadows:
+        return np.zeros((0, SHADOW_SIZE), dtype=np.uint8)
+    return np.concatenate(shadows)
+
+# Writes the shadows of a model to <name>_shadows.png and every cube map to <name>_cube_map_<index>.png, as 8-bit
+# grayscale images made from the arrays as they are. Returns the written paths, models without shadows or cube maps
+# don't get those files
+def write_images(model: Model, name: str, output_folder: str, profiler: Profiler = NO_PROFILER) -> List[str]:
+    outputs = []
+    with profiler.phase('images'):
+        sheet = shadow_sheet(model)
+        if len(sheet) > 0:
+            path = os.path.join(output_folder, f'{name}_shadows.png')
+            PILImage.fromarray(sheet).save(path)
+            outputs.append(path)
+        for index, cube_map in enumerate(model.cube_map_data):
+            if cube_map.width == 0 or cube_map.height == 0:
+                continue
+            path = os.path.join(output_folder, f'{name}_cube_map_{index}.png')
+            PILImage.fromarray(np.ascontiguousarray(cube_map.pixels, dtype=np.uint8)).save(path)
+            outputs.append(path)
+        profiler.count('shadows', len(sheet) // SHADOW_SIZE)
+        profiler.count('cube_maps', len(model.cube_map_data))
+    return outputs
@@ -0,0 +1,126 @@
+import hashlib
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from lib.parse_3db import Model, pool_as_array
+
+# UV errors are compared at this scale, so a tolerance in model units (the model spans 100) also bounds them
+TEXTURE_COORDINATE_SCALE = 100
+
+@dataclass
+class AnimationFrames:
+    animation: int
+    # Frames that are kept, as indices into animation.keyframes
+    frames: List[int]
+    # Morph target shown at each kept frame
+    targets: List[int]
+
+@dataclass
+class KeyframeAnalysis:
+    # Keyframe (index into model.keyframes) of every morph target
+    targets: List[int] = field(default_factory=list)
+    animations: List[AnimationFrames] = field(default_factory=list)
+    # Pool index -> first pool index with the same content, for every pool the kept frames use
+    vertex_pools: Dict[int, int] = field(default_factory=dict)
+    texture_coordinate_pools: Dict[int, int] = field(default_factory=dict)
+    duplicate_frames: int = 0
+    dropped_frames: int = 0
+
+# Maps every pool to the first of the given pools with identical content
+def deduplicate_pools(pools, indices, dtype, components: int) -> Dict[int, int]:
+    canonical = {}
+    first_by_hash = {}
+    for index in dict.fromkeys(indices):
+        digest = hashlib.blake2b(pool_as_array(pools[index], dtype, components).tobytes(), digest_size=16).digest()
+        canonical[index] = first_by_hash.setdefault(digest, index)
+    return canonical
+
+# Returns the frames that have to be kept so that linear interpolation between the kept frames rebuilds every dropped
+# frame within tolerance, as the maximum difference of any value. load_frame returns the values of a frame as a flat array.
+# The first and last frame are always kept. Only the frames between the last kept frame and the current candidate are held
+def reduce_frames(frame_count: int, load_frame: Callable[[int], np.ndarray], tolerance: float) -> List[int]:
+    if frame_count <= 2:
+        return list(range(frame_count))
+    loaded = {}
+
+    def frame(index: int) -> np.ndarray:
+        if index not in loaded:
+            loaded[index] = load_frame(index)
+        return loaded[index]
+
+    def rebuilds(start: int, end: int) -> bool:
+        for index in range(start + 1, end):
+            t = (index - start) / (end - start)
+            interpolated = frame(start) * (1 - t) + frame(end) * t
+            if np.abs(frame(index) - interpolated).max(initial=0) > tolerance:
+                return False
+        return True
+
+    kept = [0]
+    end = 2
+    while end < frame_count:
+        if not rebuilds(kept[-1], end):
+            kept.append(end - 1)
+            for index in [index for index in loaded if index < kept[-1]]:
+                del loaded[index]
+            end = kept[-1] + 1
+        end += 1
+    kept.append(frame_count - 1)
+    return kept
+
+# Decides which morph targets the animations of one object need. With deduplicate, keyframes whose meshes have the same
+# vertex and texture coordinate content share one target, otherwise every frame gets its own.
+# With a tolerance (in model units), frames that linear interpolation between their neighbours rebuilds are dropped,
+# the remaining frames keep their time
+def analyze_keyframes(model: Model, animation_idxs: Sequence[int], deduplicate: bool = True,
+                      tolerance: Optional[float] = None) -> KeyframeAnalysis:
+    analysis = KeyframeAnalysis()
+
+    def load_frame(keyframe_idx: int) -> np.ndarray:
+        values = []
+        for keyframe_mesh in model.keyframes[keyframe_idx].meshes:
+            values.append(pool_as_array(model.vertex_data[keyframe_mesh.vertices], np.float32, 3).reshape(-1) * 100)
+            values.append(pool_as_array(model.texture_coordinates_data[keyframe_mesh.texture_coordinates], '<f4', 2).reshape(-1) * TEXTURE_COORDINATE_SCALE)
+        return np.concatenate(values) if values else np.zeros(0, dtype=np.float32)
+
+    kept_frames = []
+    for animation_idx in animation_idxs:
+        animation = model.animations[animation_idx]
+        if tolerance is None:
+            frames = list(range(len(animation.keyframes)))
+        else:
+            frames = reduce_frames(len(animation.keyframes), lambda frame: load_frame(animation.keyframes[frame]), tolerance)
+            analysis.dropped_frames += len(animation.keyframes) - len(frames)
+        kept_frames.append(frames)
+
+    used_meshes = [keyframe_mesh for animation_idx, frames in zip(animation_idxs, kept_frames) for frame in frames
+                   for keyframe_mesh in model.keyframes[model.animations[animation_idx].keyframes[frame]].meshes]
+    if deduplicate:
+        analysis.vertex_pools = deduplicate_pools(model.vertex_data, [mesh.vertices for mesh in used_meshes], np.float32, 3)
+        analysis.texture_coordinate_pools = deduplicate_pools(model.texture_coordinates_data,
+                                                              [mesh.texture_coordinates for mesh in used_meshes], '<f4', 2)
+    else:
+        analysis.vertex_pools = {mesh.vertices: mesh.vertices for mesh in used_meshes}
+        analysis.texture_coordinate_pools = {mesh.texture_coordinates: mesh.texture_coordinates for mesh in used_meshes}
+
+    target_indices = {}
+    for animation_idx, frames in zip(animation_idxs, kept_frames):
+        animation = model.animations[animation_idx]
+        targets = []
+        for frame in frames:
+            keyframe_idx = animation.keyframes[frame]
+            if deduplicate:
+                key = tuple((analysis.vertex_pools[mesh.vertices], analysis.texture_coordinate_pools[mesh.texture_coordinates])
+                            for mesh in model.keyframes[keyframe_idx].meshes)
+            else:
+                key = (animation_idx, frame)
+            if key in target_indices:
+                analysis.duplicate_frames += 1
+            else:
+                target_indices[key] = len(analysis.targets)
+                analysis.targets.append(keyframe_idx)
+            targets.append(target_indices[key])
+        analysis.animations.append(AnimationFrames(animation_idx, frames, targets))
+    return analysis
@@ -1,10 +1,14 @@
 
-from typing import Tuple
+from typing import Iterable, Tuple, Union
 from dataclasses import dataclass
+import itertools
 import math
+import numpy as np
 
+# Single vectors use slots, so they don't carry a __dict__. For many vectors use Vector2Array / Vector3Array
 @dataclass
 class Vector2:
+    __slots__ = ('x', 'y')
     x: float
     y: float
 
@@ -40,6 +44,7 @@ class Vector2:
 
 @dataclass
 class Vector3:
+    __slots__ = ('x', 'y', 'z')
     x: float
     y: float
     z: float
@@ -79,4 +84,123 @@ class Vector3:
         return Vector3(0, 0, 0)
     
     def as_tuple(self) -> Tuple[float, float, float]:
-        return (self.x, self.y, self.z)
\ No newline at end of file
+        return (self.x, self.y, self.z)
+
+# Operand of a vector array operation: another array, a single vector that applies to every element,
+# a scalar or anything numpy broadcasts against the (n, components) data
+def _array_operand(other):
+    if isinstance(other, VectorArray):
+        return other.data
+    if isinstance(other, (Vector2, Vector3)):
+        return np.array(other.as_tuple(), dtype=np.float32)
+    return other
+
+# n vectors stored as one contiguous (n, components) float32 array, so math on all of them is done by numpy
+# without creating an object per vector. Operations return new arrays, indexing with an int returns a single vector
+class VectorArray:
+    components = 0
+    vector_type = None
+
+    def __init__(self, data):
+        self.data = np.ascontiguousarray(data, dtype=np.float32).reshape(-1, self.components)
+
+    @classmethod
+    def from_vectors(cls, vectors: Iterable):
+        vectors = list(vectors)
+        values = np.fromiter(itertools.chain.from_iterable(vector.as_tuple() for vector in vectors), dtype=np.float32,
+                             count=len(vectors) * cls.components)
+        return cls(values)
+
+    @classmethod
+    def zeros(cls, count: int):
+        return cls(np.zeros((count, cls.components), dtype=np.float32))
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.vector_type(*self.data[index].tolist())
+        return type(self)(self.data[index])
+
+    def __iter__(self):
+        return (self.vector_type(*values) for values in self.data.tolist())
+
+    def __array__(self, dtype=None, copy=None):
+        return self.data if dtype is None else self.data.astype(dtype)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({len(self)} vectors)'
+
+    def __add__(self, other):
+        return type(self)(self.data + _array_operand(other))
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return type(self)(self.data - _array_operand(other))
+
+    def __rsub__(self, other):
+        return type(self)(_array_operand(other) - self.data)
+
+    # Factor of a multiplication or division: a scalar, a vector or (components,) array per component, one factor per
+    # element as an (n, 1) array or another array of the same size. A flat array of n factors would be ambiguous
+    # when n equals the number of components, so it is refused
+    def _factor(self, other):
+        other = _array_operand(other)
+        shape = np.shape(other)
+        if shape not in ((), (self.components,), (len(self), 1), (len(self), self.components)):
+            raise ValueError(f'Can\'t scale {len(self)} {self.components} component vectors by a {shape} array, '
+                             f'per element factors have to be shaped ({len(self)}, 1)')
+        return other
+
+    def __mul__(self, other):
+        return type(self)(self.data * self._factor(other))
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        return type(self)(self.data / self._factor(other))
+
+    def __neg__(self):
+        return type(self)(-self.data)
+
+    # One value per element
+    def dot(self, other) -> np.ndarray:
+        return np.sum(self.data * _array_operand(other), axis=-1)
+
+    def length(self) -> np.ndarray:
+        return np.sqrt(self.dot(self))
+
+    # Zero length vectors stay zero, like Vector3.normalized
+    def normalized(self):
+        length = self.length()
+        safe_length = np.where(length != 0, length, 1)
+        return type(self)(self.data / safe_length[:, np.newaxis])
+
+    # Axis aligned bounding box as (min, max) vectors, zero vectors for an empty array
+    def bounds(self):
+        if len(self) == 0:
+            zero = self.vector_type(*([0.0] * self.components))
+            return zero, zero
+        return self.vector_type(*self.data.min(axis=0).tolist()), self.vector_type(*self.data.max(axis=0).tolist())
+
+    # Applies a (components x components) linear or (components + 1) square affine matrix, column vector convention
+    def transform(self, matrix):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if matrix.shape == (self.components, self.components):
+            return type(self)(self.data @ matrix.T)
+        if matrix.shape == (self.components + 1, self.components + 1):
+            return type(self)(self.data @ matrix[:self.components, :self.components].T + matrix[:self.components, self.components])
+        raise ValueError(f'Can\'t transform {self.components} component vectors with a {matrix.shape} matrix')
+
+class Vector2Array(VectorArray):
+    components = 2
+    vector_type = Vector2
+
+class Vector3Array(VectorArray):
+    components = 3
+    vector_type = Vector3
+
+    def cross(self, other: Union['Vector3Array', Vector3, np.ndarray]) -> 'Vector3Array':
+        return Vector3Array(np.cross(self.data, _array_operand(other)))
@@ -0,0 +1,49 @@
+from typing import Tuple
+
+import numpy as np
+
+# Optional, only needed for export_to_gltf(meshopt=True)
+try:
+    import meshoptimizer
+except ImportError:
+    meshoptimizer = None
+
+# Value of unused vertices in a meshoptimizer remap table
+UNUSED_VERTEX = 0xffffffff
+
+def require_meshoptimizer():
+    if meshoptimizer is None:
+        raise ImportError('Mesh optimization needs the meshoptimizer package: pip install meshoptimizer')
+
+# Reorders the triangles of a mesh for the post-transform vertex cache, then the vertices in the order the
+# triangles first use them. Returns the new indices and, for every new vertex, the index of the old vertex.
+# Every per-vertex array of the mesh (positions, morph targets, texture coordinates) has to be indexed with the
+# same order, vertices no triangle uses are dropped
+def optimize_mesh(indices: np.ndarray, vertex_count: int) -> Tuple[np.ndarray, np.ndarray]:
+    require_meshoptimizer()
+    indices = np.ascontiguousarray(indices, dtype=np.uint32)
+    cache_indices = np.zeros(len(indices), dtype=np.uint32)
+    meshoptimizer.optimize_vertex_cache(cache_indices, indices, len(indices), vertex_count)
+
+    remap = np.zeros(vertex_count, dtype=np.uint32)
+    used_count = meshoptimizer.optimize_vertex_fetch_remap(remap, cache_indices, len(indices), vertex_count)
+    used = np.flatnonzero(remap != UNUSED_VERTEX)
+    order = np.empty(used_count, dtype=np.int64)
+    order[remap[used]] = used
+    return remap[cache_indices], order
+
+# Encodes the data of a buffer view for EXT_meshopt_compression. mode is 'ATTRIBUTES' (elements of byte_stride bytes),
+# 'TRIANGLES' (a triangle list) or 'INDICES' (any other index sequence), the indices are 2 or 4 bytes wide
+def encode_buffer_view(data: bytes, mode: str, byte_stride: int) -> bytes:
+    require_meshoptimizer()
+    count = len(data) // byte_stride
+    if mode == 'ATTRIBUTES':
+        # The extension only supports version 0 of the vertex codec
+        meshoptimizer.encode_vertex_version(0)
+        return meshoptimizer.encode_vertex_buffer(np.frombuffer(data, dtype=np.uint8).reshape(count, byte_stride), count, byte_stride)
+    indices = np.frombuffer(data, dtype='<u2' if byte_stride == 2 else '<u4').astype(np.uint32)
+    vertex_count = int(indices.max()) + 1 if count > 0 else 0
+    meshoptimizer.encode_index_version(1)
+    if mode == 'TRIANGLES':
+        return meshoptimizer.encode_index_buffer(indices, count, vertex_count)
+    return meshoptimizer.encode_index_sequence(indices, count, vertex_count)
@@ -0,0 +1,179 @@
+import json
+import mmap
+import os
+import struct
+from typing import BinaryIO, Dict
+
+import numpy as np
+
+from lib.build_cache import hash_file
+from lib.math_util import Vector3
+from lib.parse_3db import (Animation, CubeMap, Keyframe, KeyframeMesh, LazyPool, Material, Model, lazy_pool, load_3db,
+                           pool_as_array)
+from lib.profiling import Profiler, NO_PROFILER
+
+MODEL_CACHE_MAGIC = b'D3DBMODL'
+# Bump when the layout of cache files changes, older files are then rebuilt
+MODEL_CACHE_VERSION = 1
+MODEL_CACHE_SUFFIX = '.3dbc'
+# magic, version, index offset, index length
+_HEADER = struct.Struct('<8sIQQ')
+# Every array starts aligned to this, so it can be viewed without a copy
+ARRAY_ALIGNMENT = 16
+
+# Writes arrays back to back, aligned, and records where they are
+class _ArrayWriter:
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.arrays: Dict[str, list] = {}
+
+    def _align(self):
+        position = self.stream.tell()
+        self.stream.write(bytes(-position % ARRAY_ALIGNMENT))
+
+    def write(self, name: str, value: np.ndarray):
+        self.write_entries(name, [value], value.dtype, value.shape[1:])
+
+    # Writes the entries one after another as a single array of the given dtype
+    def write_entries(self, name: str, entries, dtype, row_shape=()):
+        dtype = np.dtype(dtype)
+        self._align()
+        offset = self.stream.tell()
+        rows = 0
+        for entry in entries:
+            entry = np.ascontiguousarray(entry, dtype=dtype)
+            rows += len(entry)
+            self.stream.write(entry.tobytes())
+        self.arrays[name] = [offset, dtype.str, [rows] + list(row_shape)]
+
+# Writes everything export_to_gltf and write_3db need from a model into a cache file: the tables as JSON,
+# the keyframes and all pools as flat arrays. Vertices are stored dequantized, so loading them is a plain view.
+# Pools are written one entry at a time, so lazily loaded models are never decoded all at once
+def save_model_cache(model: Model, path: str, source_hash: str = ''):
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MODEL_CACHE_MAGIC, MODEL_CACHE_VERSION, 0, 0))
+        writer = _ArrayWriter(f)
+
+        keyframes = list(model.keyframes)
+        writer.write('keyframe_mesh_counts', np.array([len(keyframe.meshes) for keyframe in keyframes], dtype='<u2'))
+        writer.write('keyframe_meshes', np.array([[mesh.material, mesh.unknown, mesh.triangles, mesh.texture_coordinates,
+                                                   mesh.vertices, mesh.brightness]
+                                                  for keyframe in keyframes for mesh in keyframe.meshes], dtype='<u2').reshape(-1, 6))
+        writer.write('keyframe_vectors', np.array([keyframe.unknown1.as_tuple() + keyframe.unknown2.as_tuple()
+                                                   for keyframe in keyframes], dtype='<f4').reshape(-1, 6))
+        writer.write('keyframe_unknown', np.frombuffer(b''.join(keyframe._unknown for keyframe in keyframes), dtype='u1'))
+
+        pools = {'triangles': (model.triangle_data, '<u2', 1), 'texture_coordinates': (model.texture_coordinates_data, '<f4', 2),
+                 'vertices': (model.vertex_data, '<f4', 3), 'brightness': (model.brightness_data, 'u1', 1)}
+        for name, (pool, dtype, components) in pools.items():
+            writer.write(f'{name}_counts', np.array([len(entry) for entry in pool], dtype='<u4'))
+            writer.write_entries(name, (pool_as_array(entry, dtype, components) for entry in pool), dtype,
+                                 (components,) if components > 1 else ())
+        writer.write_entries('shadows', (pool_as_array(shadow, 'u1').reshape(1, 32, 32) for shadow in model.shadow_data), 'u1', (32, 32))
+        cube_maps = list(model.cube_map_data)
+        writer.write_entries('cube_map_pixels', (cube_map.pixels.reshape(-1) for cube_map in cube_maps), 'u1')
+        writer.write('unknown_records', np.frombuffer(model._unknown_records, dtype='u1'))
+
+        index = {
+            'source_hash': source_hash,
+            'db_version': model.db_version,
+            'name': model.name,
+            'materials': [[material.name, material.texture_path, material._unknown] for material in model.materials],
+            'objects': model.objects,
+            'animations': [[animation.name, list(animation.keyframes), animation._unknown_u16, animation._unknown_f32,
+                            animation._unknown_string, animation._unknown_vec1.as_tuple(), animation._unknown_vec2.as_tuple()]
+                           for animation in model.animations],
+            'cube_maps': [[cube_map.width, cube_map.height, cube_map.unknown1, cube_map.unknown2] for cube_map in cube_maps],
+            'arrays': writer.arrays,
+        }
+        index_data = json.dumps(index).encode('utf-8')
+        index_offset = f.tell()
+        f.write(index_data)
+        f.seek(0)
+        f.write(_HEADER.pack(MODEL_CACHE_MAGIC, MODEL_CACHE_VERSION, index_offset, len(index_data)))
+
+# Reads the index of a cache file, raises ValueError if it isn't one or has another version
+def read_model_cache_index(data) -> Dict:
+    if len(data) < _HEADER.size:
+        raise ValueError('Not a model cache file')
+    magic, version, index_offset, index_length = _HEADER.unpack_from(data)
+    if magic != MODEL_CACHE_MAGIC:
+        raise ValueError('Not a model cache file')
+    if version != MODEL_CACHE_VERSION:
+        raise ValueError(f'Model cache version {version}, expected {MODEL_CACHE_VERSION}')
+    return json.loads(bytes(data[index_offset:index_offset + index_length]).decode('utf-8'))
+
+# Maps a cache file and returns its model. Pools and keyframes are views of the mapping that are only
+# created when they are accessed, nothing is decoded up front
+def open_model_cache(path: str, profiler: Profiler = NO_PROFILER) -> Model:
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    index = read_model_cache_index(data)
+    arrays = index['arrays']
+
+    def array(name: str) -> np.ndarray:
+        offset, dtype, shape = arrays[name]
+        count = int(np.prod(shape))
+        return np.frombuffer(data, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+    def pool(name: str, components: int = 1, weak: bool = False) -> LazyPool:
+        return lazy_pool(data, arrays[name][0], array(f'{name}_counts'), arrays[name][1], components, weak=weak, profiler=profiler)
+
+    mesh_counts = array('keyframe_mesh_counts')
+    mesh_starts = np.concatenate(([0], np.cumsum(mesh_counts, dtype=np.int64)))
+    keyframe_meshes = array('keyframe_meshes')
+    keyframe_vectors = array('keyframe_vectors')
+    keyframe_unknown = array('keyframe_unknown').reshape(len(mesh_counts), -1) if len(mesh_counts) > 0 else None
+
+    def keyframe(index: int) -> Keyframe:
+        meshes = [KeyframeMesh(*values) for values in keyframe_meshes[mesh_starts[index]:mesh_starts[index + 1]].tolist()]
+        vectors = keyframe_vectors[index].tolist()
+        return Keyframe(meshes, Vector3(*vectors[:3]), Vector3(*vectors[3:]), keyframe_unknown[index].tobytes())
+
+    materials = [Material(name, texture_path, unknown) for name, texture_path, unknown in index['materials']]
+    animations = [Animation(name, keyframes, unknown_u16, unknown_f32, unknown_string, Vector3(*vec1), Vector3(*vec2))
+                  for name, keyframes, unknown_u16, unknown_f32, unknown_string, vec1, vec2 in index['animations']]
+
+    cube_map_pixels = array('cube_map_pixels')
+    cube_map_starts = np.concatenate(([0], np.cumsum([width * height for width, height, _, _ in index['cube_maps']], dtype=np.int64)))
+
+    def cube_map(index_: int) -> CubeMap:
+        width, height, unknown1, unknown2 = index['cube_maps'][index_]
+        pixels = cube_map_pixels[cube_map_starts[index_]:cube_map_starts[index_ + 1]].reshape(height, width)
+        return CubeMap(width, height, unknown1, unknown2, pixels)
+
+    shadows = array('shadows')
+    return Model(index['db_version'], index['name'], materials, LazyPool(len(mesh_counts), keyframe), index['objects'], animations,
+                 pool('triangles'), pool('texture_coordinates', 2), pool('vertices', 3), pool('brightness'),
+                 LazyPool(len(shadows), lambda index_: shadows[index_]), LazyPool(len(index['cube_maps']), cube_map),
+                 array('unknown_records').tobytes())
+
+# Path of the cache file of a source file with this hash
+def model_cache_path(cache_folder: str, source_hash: str) -> str:
+    return os.path.join(cache_folder, source_hash + MODEL_CACHE_SUFFIX)
+
+# load_3db through a cache folder: the model is read from the cache file of the source's content hash, which is
+# written first if it doesn't exist yet (or is from another cache version)
+def load_3db_cached(path: str, cache_folder: str, profiler: Profiler = NO_PROFILER) -> Model:
+    source_hash = hash_file(path)
+    cache_path = model_cache_path(cache_folder, source_hash)
+    if os.path.isfile(cache_path):
+        try:
+            with profiler.phase('open_model_cache'):
+                return open_model_cache(cache_path, profiler)
+        except ValueError:
+            pass
+
+    model = load_3db(path, profiler)
+    os.makedirs(cache_folder, exist_ok=True)
+    # Other processes may be writing the same cache file
+    temp_path = f'{cache_path}.{os.getpid()}.tmp'
+    try:
+        with profiler.phase('save_model_cache'):
+            save_model_cache(model, temp_path, source_hash)
+        os.replace(temp_path, cache_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return model
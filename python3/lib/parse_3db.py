@@ -1,10 +1,23 @@
+import mmap
 import struct
-from dataclasses import dataclass
-from typing import List, Dict
+import weakref
+from dataclasses import dataclass, field
+from typing import List, Dict, Tuple, Callable, Sequence
+import numpy as np
 from lib.math_util import Vector3, Vector2
+from lib.profiling import Profiler, NO_PROFILER
+from lib.schema import (Record, KEYFRAME_UNKNOWN_SIZE, MATERIAL_TRAILER, KEYFRAME_MESH, KEYFRAME_TRAILER, ANIMATION_VALUES,
+                        ANIMATION_VECTORS, CUBE_MAP_HEADER, POOL_COUNTS, keyframe_dtype)
 
 # FIXME: Surely theres a nice python library already for this
 class Deserializer:
+    _U8 = struct.Struct('<B')
+    _U16 = struct.Struct('<H')
+    _U32 = struct.Struct('<I')
+    _F32 = struct.Struct('<f')
+    _VEC2 = struct.Struct('<2f')
+    _VEC3 = struct.Struct('<3f')
+
     def __init__(self, data: bytes):
         self.data = data
         self.offset = 0
@@ -13,48 +26,69 @@ class Deserializer:
         self.offset += count
 
     def read_u8(self):
-        value = struct.unpack_from('B', self.data, self.offset)[0]
-        self.advance(struct.calcsize('B'))
+        value = self._U8.unpack_from(self.data, self.offset)[0]
+        self.advance(1)
         return value
 
     def read_u16(self) -> int:
-        value = struct.unpack_from('H', self.data, self.offset)[0]
-        self.advance(struct.calcsize('H'))
+        value = self._U16.unpack_from(self.data, self.offset)[0]
+        self.advance(2)
         return value
 
     def read_u32(self) -> int:
-        value = struct.unpack_from('I', self.data, self.offset)[0]
-        self.advance(struct.calcsize('I'))
+        value = self._U32.unpack_from(self.data, self.offset)[0]
+        self.advance(4)
         return value
 
     # by default, decode str as utf-8 encoded string
     def read_string(self) -> str:
-        length = self.read_u32() 
-        string = struct.unpack_from(f'{length}s', self.data, self.offset)[0]
-        self.advance(length)
-        return string.decode('utf-8')
+        return self.read_str().decode('utf-8')
     
     def read_str(self) -> str:
         length = self.read_u32() 
-        string = struct.unpack_from(f'{length}s', self.data, self.offset)[0]
-        self.advance(length)
+        string = self.read_bytes(length)
+        if len(string) != length:
+            raise struct.error(f'String of {length} bytes runs past the end of the data')
         return string
 
     def read_f32(self) -> float:
-        value = struct.unpack_from('f', self.data, self.offset)[0]
-        self.advance(struct.calcsize('f'))
+        value = self._F32.unpack_from(self.data, self.offset)[0]
+        self.advance(4)
         return value
 
     def read_vec2(self) -> Vector2:
-        x = self.read_f32()
-        y = self.read_f32()
-        return Vector2(x, y)
+        value = Vector2(*self._VEC2.unpack_from(self.data, self.offset))
+        self.advance(8)
+        return value
     
     def read_vec3(self) -> Vector3:
-        x = self.read_f32()
-        y = self.read_f32()
-        z = self.read_f32()
-        return Vector3(x, y, z)
+        value = Vector3(*self._VEC3.unpack_from(self.data, self.offset))
+        self.advance(12)
+        return value
+
+    # Values of the fields of a schema record
+    def read_record(self, record: Record) -> list:
+        values = record.unpack_from(self.data, self.offset)
+        self.advance(record.size)
+        return values
+
+    def read_bytes(self, count: int) -> bytes:
+        value = bytes(self.data[self.offset:self.offset + count])
+        self.advance(count)
+        return value
+
+    # Returns a zero-copy numpy view over the next count elements
+    def read_array(self, dtype, count: int) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        value = np.frombuffer(self.data, dtype=dtype, count=count, offset=self.offset)
+        self.advance(dtype.itemsize * count)
+        return value
+
+# Splits a flat pool into one view per entry of its count table
+def split_pool(pool: np.ndarray, counts: np.ndarray) -> List[np.ndarray]:
+    if len(counts) == 0:
+        return []
+    return np.split(pool, np.cumsum(counts)[:-1])
 
 @dataclass
 class KeyframeMesh:
@@ -68,6 +102,11 @@ class KeyframeMesh:
 @dataclass
 class Keyframe:
     meshes: List[KeyframeMesh]
+    # TODO: Could be transform and rotation per keyframe??
+    unknown1: Vector3 = field(default_factory=lambda: Vector3(0.0, 0.0, 0.0))
+    unknown2: Vector3 = field(default_factory=lambda: Vector3(0.0, 0.0, 0.0))
+    # Not interpreted, only kept so the file can be written back unchanged
+    _unknown: bytes = bytes(KEYFRAME_UNKNOWN_SIZE)
 
 @dataclass
 class Material:
@@ -79,27 +118,170 @@ class Material:
 class Animation:
     name: str
     keyframes: List[int]
+    # Unknown values following the keyframe indices
+    _unknown_u16: int = 0
+    _unknown_f32: float = 0.0
+    _unknown_string: str = ''
+    _unknown_vec1: Vector3 = field(default_factory=lambda: Vector3(0.0, 0.0, 0.0))
+    _unknown_vec2: Vector3 = field(default_factory=lambda: Vector3(0.0, 0.0, 0.0))
 
 @dataclass
-class Model:
+class CubeMap:
+    width: int
+    height: int
+    unknown1: int
+    unknown2: int
+    # (height, width) u8 view
+    pixels: np.ndarray
+
+# Everything that comes after the animation table, recorded as offsets by the header pass
+# so the sections can be decoded later (or never)
+@dataclass
+class PoolLayout:
+    shadow_offset: int
+    shadow_count: int
+    # (offset, width, height, unknown1, unknown2) per cube map
+    cube_maps: List[Tuple[int, int, int, int, int]]
+    triangle_counts: np.ndarray
+    texture_coordinate_counts: np.ndarray
+    vertex_counts: np.ndarray
+    brightness_counts: np.ndarray
+    # Byte offset of the first pool (triangles), the others follow back to back
+    pools_offset: int
+
+    def pool_offsets(self) -> Tuple[int, int, int, int]:
+        triangles_offset = self.pools_offset
+        texture_coordinates_offset = triangles_offset + 2 * int(self.triangle_counts.sum())
+        vertices_offset = texture_coordinates_offset + 8 * int(self.texture_coordinate_counts.sum())
+        brightness_offset = vertices_offset + 6 * int(self.vertex_counts.sum())
+        return triangles_offset, texture_coordinates_offset, vertices_offset, brightness_offset
+
+@dataclass
+class Header:
     db_version: str
     name: str
     materials: List[Material]
     keyframes: List[Keyframe]
     objects: Dict[str, int]
     animations: List[Animation]
-    triangle_data: List[List[int]]
-    texture_coordinates_data: List[List[Vector2]]
-    vertex_data: List[List[Vector3]]
-    brightness_data: List[List[int]]    
-
-
-# Basic python3 implementation of the same logic as the C# and python2.7
-# implementations 
-def parse_3db_file(raw_data):
-
-    deserializer = Deserializer(raw_data)
+    layout: PoolLayout
+    # The unknown 20 byte records after the count tables
+    _unknown_records: bytes = b''
 
+@dataclass
+class Model:
+    db_version: str
+    name: str
+    materials: List[Material]
+    keyframes: List[Keyframe]
+    objects: Dict[str, int]
+    animations: List[Animation]
+    # Each pool entry is a numpy view: triangles (n,) u16, texture coordinates (n, 2) f32,
+    # vertices (n, 3) f32 in [0, 1], brightness (n,) u8.
+    # With legacy_vectors=True these are plain lists of ints / Vector2 / Vector3 instead
+    triangle_data: List[np.ndarray]
+    texture_coordinates_data: List[np.ndarray]
+    vertex_data: List[np.ndarray]
+    brightness_data: List[np.ndarray]
+    # 32x32 u8 views
+    shadow_data: List[np.ndarray] = field(default_factory=list)
+    cube_map_data: List[CubeMap] = field(default_factory=list)
+    # The unknown 20 byte records after the count tables, only kept to write the file back
+    _unknown_records: bytes = b''
+
+
+# Read-only sequence that decodes each entry the first time it is accessed.
+# With weak=True decoded entries are only cached while they are still referenced somewhere else,
+# for entries that are copies rather than views of the file, so memory doesn't grow with every entry ever accessed
+class LazyPool(Sequence):
+    def __init__(self, length: int, decode: Callable[[int], object], weak: bool = False):
+        self._entries = [None] * length
+        self._decode = decode
+        self._weak = weak
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        entry = self._entries[index]
+        if self._weak and entry is not None:
+            entry = entry()
+        if entry is None:
+            entry = self._decode(index % len(self._entries))
+            self._entries[index] = weakref.ref(entry) if self._weak else entry
+        return entry
+
+# Lazily decoded pool of per-entry views. Entry i starts at offset + (sum of the previous counts) * row size
+def lazy_pool(data, offset: int, counts: np.ndarray, dtype, components: int = 1,
+              transform: Callable[[np.ndarray], np.ndarray] = None, weak: bool = False,
+              profiler: Profiler = NO_PROFILER) -> LazyPool:
+    dtype = np.dtype(dtype)
+    row_size = dtype.itemsize * components
+    starts = np.concatenate(([0], np.cumsum(counts, dtype=np.int64)[:-1]))
+
+    def decode(index: int) -> np.ndarray:
+        count = int(counts[index])
+        view = np.frombuffer(data, dtype=dtype, count=count * components, offset=offset + int(starts[index]) * row_size)
+        if components > 1:
+            view = view.reshape(-1, components)
+        if transform is not None:
+            view = transform(view)
+        return view
+
+    return LazyPool(len(counts), profiler.wrap('decode_pools', decode), weak)
+
+def dequantize_vertices(vertices: np.ndarray) -> np.ndarray:
+    return vertices.astype(np.float32) / np.float32(0xffff)
+
+# Inverse of dequantize_vertices, exact for vertices that were read from a file
+def quantize_vertices(vertices: np.ndarray) -> np.ndarray:
+    return np.clip(np.round(np.asarray(vertices, dtype=np.float64) * 0xffff), 0, 0xffff).astype('<u2')
+
+# Pools are numpy arrays unless the model was parsed with legacy_vectors=True
+def pool_as_array(pool, dtype, components: int = 1) -> np.ndarray:
+    if not isinstance(pool, np.ndarray):
+        pool = np.array([tuple(p) if components > 1 else p for p in pool], dtype=dtype)
+    if components > 1:
+        pool = pool.reshape(-1, components)
+    return pool.astype(dtype, copy=False)
+
+# Number of keyframes the first look for the end of a run of keyframes covers, doubled until the run ends
+KEYFRAME_RUN_PROBE = 64
+
+# Keyframes are decoded in runs of keyframes with the same mesh count, each run as one structured array
+def read_keyframes(deserializer: Deserializer, keyframe_count: int) -> List[Keyframe]:
+    data = deserializer.data
+    keyframes = []
+    while len(keyframes) < keyframe_count:
+        mesh_count = Deserializer._U16.unpack_from(data, deserializer.offset)[0]
+        dtype = keyframe_dtype(mesh_count)
+        # At least one keyframe, so a truncated table raises
+        available = max(1, min(keyframe_count - len(keyframes), (len(data) - deserializer.offset) // dtype.itemsize))
+        count = min(available, KEYFRAME_RUN_PROBE)
+        while True:
+            run = np.frombuffer(data, dtype=dtype, count=count, offset=deserializer.offset)
+            other_counts = np.flatnonzero(run['mesh_count'] != mesh_count)
+            if len(other_counts) > 0:
+                run = run[:other_counts[0]]
+                break
+            if count == available:
+                break
+            count = min(available, count * 2)
+
+        meshes = []
+        if mesh_count > 0:
+            meshes = [KeyframeMesh(*values) for values in zip(*KEYFRAME_MESH.columns(run['meshes']))]
+        unknown1, unknown2, unknown = KEYFRAME_TRAILER.columns(run['trailer'])
+        for i in range(len(run)):
+            keyframes.append(Keyframe(meshes[i * mesh_count:(i + 1) * mesh_count], unknown1[i], unknown2[i], unknown[i]))
+        deserializer.advance(len(run) * dtype.itemsize)
+    return keyframes
+
+# Reads the tables of a 3db file and records where the shadows, cube maps and pools are,
+# without decoding any of them. Leaves the deserializer at the first pool
+def read_header(deserializer: Deserializer) -> Header:
     # Read DB version
     db_version = deserializer.read_string()
 
@@ -115,7 +297,7 @@ def parse_3db_file(raw_data):
         material_name = deserializer.read_string()
         material_texture_path = deserializer.read_string()
         # TODO: this might be a material type?
-        material_unknown = deserializer.read_u32()
+        material_unknown, = deserializer.read_record(MATERIAL_TRAILER)
 
         material = Material(material_name, material_texture_path, material_unknown)
         materials.append(material)
@@ -131,41 +313,13 @@ def parse_3db_file(raw_data):
     keyframe_count = deserializer.read_u32()
 
     # Read meshes
-    keyframes = []
-    for _ in range(keyframe_count):
-        # TODO: Verify
-        # Each keyframe seems to have a fixed number of meshes, depending on the object to which it belongs
-        # Example: 
-        # Baby.3db only contains the baby object, which consists of two meshes - each keyframe always has to meshes
-        # Ringe.3db contains ring objects, which have multiple keyframes, but only one mesh per keyframe. meshes_in_keyframe_count is always 1 for there keyframes
-        # but it also contains the greipnir objects, which consists of 8 meshes each, so mesh_in_keyframe_count is always 8
-        meshes_in_keyframe_count = deserializer.read_u16()
-
-        meshes_in_keyframe = []
-        for _ in range(meshes_in_keyframe_count):
-            kf_material_idx = deserializer.read_u16()
-            # TODO: this is just 1 most of the time, so probably not normals
-            kf_unknown_idx = deserializer.read_u16()
-            kf_triangles_idx = deserializer.read_u16()
-            kf_texture_coordinates_idx = deserializer.read_u16()
-            kf_vertices_idx = deserializer.read_u16()
-            kf_brightness_idx = deserializer.read_u16()
-
-            link = KeyframeMesh(kf_material_idx, kf_unknown_idx, kf_triangles_idx,
-                            kf_texture_coordinates_idx, kf_vertices_idx,
-                            kf_brightness_idx)
-            meshes_in_keyframe.append(link)
-
-        # TODO: Could be transform and rotation per keyframe??
-        unknown1 = deserializer.read_vec3()
-        unknown2 = deserializer.read_vec3()
-        deserializer.advance(0x80)
-        deserializer.advance(2)
-        deserializer.advance(0x30)
-        deserializer.advance(2)
-
-        keyframe = Keyframe(meshes_in_keyframe)
-        keyframes.append(keyframe)
+    # TODO: Verify
+    # Each keyframe seems to have a fixed number of meshes, depending on the object to which it belongs
+    # Example: 
+    # Baby.3db only contains the baby object, which consists of two meshes - each keyframe always has to meshes
+    # Ringe.3db contains ring objects, which have multiple keyframes, but only one mesh per keyframe. meshes_in_keyframe_count is always 1 for there keyframes
+    # but it also contains the greipnir objects, which consists of 8 meshes each, so mesh_in_keyframe_count is always 8
+    keyframes = read_keyframes(deserializer, keyframe_count)
 
     # Read which objects are contained in the 3db-file
     # Example: baby.3db has only one object (baby), ringe.3db has multiple objects (individual rings and greipnir)
@@ -176,11 +330,7 @@ def parse_3db_file(raw_data):
     for _ in range(object_count):
         object_name = deserializer.read_string()    
         animation_count_for_object = deserializer.read_u16()
-        anims = []
-        for _ in range(animation_count_for_object):
-            animation_idx = deserializer.read_u32()
-            anims.append(animation_idx)
-        objects[object_name] = anims
+        objects[object_name] = deserializer.read_array('<u4', animation_count_for_object).tolist()
 
     # Read animation data
     animations = []
@@ -191,18 +341,15 @@ def parse_3db_file(raw_data):
 
         frame_count = deserializer.read_u16()
         total_frame_count+=frame_count
-        frame_indices = []
-        for _ in range(frame_count):
-            frame_indices.append(deserializer.read_u32())
-
-        # Read and ignore unknown values
-        deserializer.read_u16()
-        deserializer.read_f32()
-        deserializer.read_string()
-        deserializer.read_vec3()
-        deserializer.read_vec3()
-
-        animation = Animation(animation_name, frame_indices)
+        frame_indices = deserializer.read_array('<u4', frame_count).tolist()
+
+        # Read unknown values
+        animation_unknown_u16, animation_unknown_f32 = deserializer.read_record(ANIMATION_VALUES)
+        animation_unknown_string = deserializer.read_string()
+        animation_unknown_vec1, animation_unknown_vec2 = deserializer.read_record(ANIMATION_VECTORS)
+
+        animation = Animation(animation_name, frame_indices, animation_unknown_u16, animation_unknown_f32,
+                              animation_unknown_string, animation_unknown_vec1, animation_unknown_vec2)
         animations.append(animation)
     # TODO: Add a check if total_cnt matches the number of frames in the animations
     # If not, it might mean that there are unused frames in the 3db-file
@@ -210,79 +357,146 @@ def parse_3db_file(raw_data):
 
     # Skip shadows
     shadow_count = deserializer.read_u16()
-    for _ in range(shadow_count):
-        deserializer.advance(32 * 32)
+    shadow_offset = deserializer.offset
+    deserializer.advance(shadow_count * 32 * 32)
 
     # Read Cube maps?
     cube_map_count = deserializer.read_u16()
+    cube_maps = []
     for _ in range(cube_map_count):
-        width = deserializer.read_u16()
-        height = deserializer.read_u16()
-        deserializer.read_u16()
-        deserializer.read_u16()
+        width, height, cube_map_unknown1, cube_map_unknown2 = deserializer.read_record(CUBE_MAP_HEADER)
+        cube_maps.append((deserializer.offset, width, height, cube_map_unknown1, cube_map_unknown2))
         # Skip pixel data
         deserializer.advance(width * height)
 
-    # Read triangles
-    triangle_count = deserializer.read_u16()
-
-    # Read texture coordinates?
-    texture_coordinate_count = deserializer.read_u16()
-
-    # Read vertices
-    vertex_count = deserializer.read_u16()
-
-    # Read brightness
-    brightness_count = deserializer.read_u16()
+    # Number of triangle, texture coordinate, vertex and brightness pools and of unknown records
+    triangle_count, texture_coordinate_count, vertex_count, brightness_count, unknown_count = deserializer.read_record(POOL_COUNTS)
 
-    unknown_count = deserializer.read_u32()
+    # Read count tables
+    triangle_counts = deserializer.read_array('<u2', triangle_count)
+    texture_coordinate_counts = deserializer.read_array('<u2', texture_coordinate_count)
+    vertex_counts = deserializer.read_array('<u2', vertex_count)
+    brightness_counts = deserializer.read_array('<u2', brightness_count)
 
-    # Read triangle counts
-    triangle_counts = []
-    for _ in range(triangle_count):
-        count = deserializer.read_u16()
-        triangle_counts.append(count)
+    unknown_records = deserializer.read_bytes(unknown_count * 20)
 
-    texture_coordinate_counts = []
-    for _ in range(texture_coordinate_count):
-        texture_coordinate_counts.append(deserializer.read_u16())
+    layout = PoolLayout(shadow_offset, shadow_count, cube_maps, triangle_counts, texture_coordinate_counts,
+                        vertex_counts, brightness_counts, deserializer.offset)
+    return Header(db_version, name, materials, keyframes, objects, animations, layout, unknown_records)
 
-    vertex_counts = []
-    for _ in range(vertex_count):
-        vertex_counts.append(deserializer.read_u16())
+def read_shadows(data, layout: PoolLayout) -> np.ndarray:
+    return np.frombuffer(data, dtype='u1', count=layout.shadow_count * 32 * 32,
+                         offset=layout.shadow_offset).reshape(-1, 32, 32)
 
-    brightness_counts = []
-    for _ in range(brightness_count):
-        brightness_counts.append(deserializer.read_u16())
+def read_cube_map(data, cube_map: Tuple[int, int, int, int, int]) -> CubeMap:
+    offset, width, height, unknown1, unknown2 = cube_map
+    pixels = np.frombuffer(data, dtype='u1', count=width * height, offset=offset).reshape(height, width)
+    return CubeMap(width, height, unknown1, unknown2, pixels)
 
-    for _ in range(unknown_count):
-        deserializer.advance(20)
-
-    # Read actual triangle data
-    triangle_data = [[deserializer.read_u16() for _ in range(count)] for count in triangle_counts]
-
-    # Read texture coordinates data
-    texture_coordinates_data = [[deserializer.read_vec2() for _ in range(count)] for count in texture_coordinate_counts]
+# Basic python3 implementation of the same logic as the C# and python2.7
+# implementations
+# Pools are returned as numpy views over raw_data. legacy_vectors=True decodes them element by
+# element into Vector2/Vector3 lists instead, which is much slower and only kept for compatibility
+def parse_3db_file(raw_data, legacy_vectors: bool = False, profiler: Profiler = NO_PROFILER):
 
-    # Read vertices data
-    vertices_data = [
-        [Vector3(deserializer.read_u16() / float(0xffff),
-                    deserializer.read_u16() / float(0xffff),
-                    deserializer.read_u16() / float(0xffff))
-                    for _ in range(count)]
-        for count in vertex_counts]
+    deserializer = Deserializer(raw_data)
+    with profiler.phase('parse_header'):
+        header = read_header(deserializer)
+    layout = header.layout
+    triangle_counts = layout.triangle_counts
+    texture_coordinate_counts = layout.texture_coordinate_counts
+    vertex_counts = layout.vertex_counts
+    brightness_counts = layout.brightness_counts
+
+    with profiler.phase('decode_pools'):
+        if legacy_vectors:
+            # Read actual triangle data
+            triangle_data = [[deserializer.read_u16() for _ in range(count)] for count in triangle_counts]
+
+            # Read texture coordinates data
+            texture_coordinates_data = [[deserializer.read_vec2() for _ in range(count)] for count in texture_coordinate_counts]
+
+            # Read vertices data
+            vertices_data = [
+                [Vector3(deserializer.read_u16() / float(0xffff),
+                            deserializer.read_u16() / float(0xffff),
+                            deserializer.read_u16() / float(0xffff))
+                            for _ in range(count)]
+                for count in vertex_counts]
     
-    # Read brightness data
-    brightness_data = []
-    for i in range(brightness_count):
-        count = brightness_counts[i]
-        brightness = []
-        for _ in range(count):
-            brightness.append(deserializer.read_u8())
-        brightness_data.append(brightness)
-
-
-    result = Model(db_version, name, materials, keyframes, objects, animations,
-            triangle_data, texture_coordinates_data, vertices_data, brightness_data)
+            # Read brightness data
+            brightness_data = []
+            for i in range(len(brightness_counts)):
+                count = brightness_counts[i]
+                brightness = []
+                for _ in range(count):
+                    brightness.append(deserializer.read_u8())
+                brightness_data.append(brightness)
+        else:
+            # Read actual triangle data
+            triangle_pool = deserializer.read_array('<u2', int(triangle_counts.sum()))
+            triangle_data = split_pool(triangle_pool, triangle_counts)
+
+            # Read texture coordinates data
+            texture_coordinates_pool = deserializer.read_array('<f4', 2 * int(texture_coordinate_counts.sum())).reshape(-1, 2)
+            texture_coordinates_data = split_pool(texture_coordinates_pool, texture_coordinate_counts)
+
+            # Read vertices data, dequantized once for the whole pool
+            vertices_pool = deserializer.read_array('<u2', 3 * int(vertex_counts.sum())).reshape(-1, 3)
+            vertices_pool = dequantize_vertices(vertices_pool)
+            vertices_data = split_pool(vertices_pool, vertex_counts)
+
+            # Read brightness data
+            brightness_pool = deserializer.read_array('u1', int(brightness_counts.sum()))
+            brightness_data = split_pool(brightness_pool, brightness_counts)
+
+        shadow_data = list(read_shadows(raw_data, layout))
+        cube_map_data = [read_cube_map(raw_data, cube_map) for cube_map in layout.cube_maps]
+
+    result = Model(header.db_version, header.name, header.materials, header.keyframes, header.objects,
+            header.animations, triangle_data, texture_coordinates_data, vertices_data, brightness_data,
+            shadow_data, cube_map_data, header._unknown_records)
     return result
 
+# Memory-maps a 3db file and only reads its tables up front. Shadows, cube maps and pool entries
+# are decoded the first time they are accessed through the returned Model, which the profiler
+# records as decode_pools phases wherever that happens
+def load_3db(path: str, profiler: Profiler = NO_PROFILER) -> Model:
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    with profiler.phase('parse_header'):
+        header = read_header(Deserializer(data))
+    layout = header.layout
+    triangles_offset, texture_coordinates_offset, vertices_offset, brightness_offset = layout.pool_offsets()
+
+    triangle_data = lazy_pool(data, triangles_offset, layout.triangle_counts, '<u2', profiler=profiler)
+    texture_coordinates_data = lazy_pool(data, texture_coordinates_offset, layout.texture_coordinate_counts, '<f4', 2,
+                                         profiler=profiler)
+    vertices_data = lazy_pool(data, vertices_offset, layout.vertex_counts, '<u2', 3, dequantize_vertices, weak=True,
+                              profiler=profiler)
+    brightness_data = lazy_pool(data, brightness_offset, layout.brightness_counts, 'u1', profiler=profiler)
+    shadow_data = lazy_pool(data, layout.shadow_offset, np.full(layout.shadow_count, 32), 'u1', 32, profiler=profiler)
+    cube_map_data = LazyPool(len(layout.cube_maps),
+                             profiler.wrap('decode_pools', lambda index: read_cube_map(data, layout.cube_maps[index])))
+
+    return Model(header.db_version, header.name, header.materials, header.keyframes, header.objects,
+                 header.animations, triangle_data, texture_coordinates_data, vertices_data, brightness_data,
+                 shadow_data, cube_map_data, header._unknown_records)
+
+# Reads only the tables at the start of a file (names, materials, keyframes, objects, animations and pool counts),
+# the pools are never touched. The layout still records where they are, but the file is closed again
+def scan_3db(path: str) -> Header:
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    # Only closed after a successful read: the error of a broken file can still reference views of the mapping,
+    # and closing it then would raise a BufferError instead. The mapping is released with the views in that case
+    header = read_header(Deserializer(data))
+    # The count tables are views of the mapping, which can only be closed without them
+    layout = header.layout
+    layout.triangle_counts = layout.triangle_counts.copy()
+    layout.texture_coordinate_counts = layout.texture_coordinate_counts.copy()
+    layout.vertex_counts = layout.vertex_counts.copy()
+    layout.brightness_counts = layout.brightness_counts.copy()
+    data.close()
+    return header
@@ -0,0 +1,120 @@
+import json
+import time
+import tracemalloc
+from contextlib import nullcontext
+from typing import Callable, Dict, List
+
+# Collects wall time and traced allocations per named phase, plus free-form counters.
+# Phases can be nested, a phase then includes the time and memory of the phases inside it.
+# Memory is traced with tracemalloc, which sees the allocations of every thread, so phases that run
+# while the texture threads are busy also account for some of their memory.
+# A disabled profiler does nothing, use NO_PROFILER where no profiler was passed
+class Profiler:
+    def __init__(self, enabled: bool = True, trace_memory: bool = True):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.phases: Dict[str, Dict] = {}
+        self.counters: Dict[str, int] = {}
+        self._stack: List['_Phase'] = []
+        self._owns_tracing = False
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracing = True
+
+    def stop(self):
+        if self._owns_tracing:
+            tracemalloc.stop()
+            self._owns_tracing = False
+
+    def phase(self, name: str):
+        if not self.enabled:
+            return nullcontext()
+        return _Phase(self, name)
+
+    # Returns fn, timed as the given phase on every call when enabled
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        if not self.enabled:
+            return fn
+
+        def profiled(*args, **kwargs):
+            with self.phase(name):
+                return fn(*args, **kwargs)
+        return profiled
+
+    def count(self, name: str, value: int = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self) -> Dict:
+        return {'phases': self.phases, 'counters': self.counters}
+
+    def write(self, path: str):
+        write_report(self.report(), path)
+
+class _Phase:
+    def __init__(self, profiler: Profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        profiler = self.profiler
+        self.memory_start = 0
+        self.peak = 0
+        if profiler.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            # The peak is reset for this phase, so the enclosing phase keeps the peak reached so far
+            if profiler._stack:
+                parent = profiler._stack[-1]
+                parent.peak = max(parent.peak, peak)
+            tracemalloc.reset_peak()
+            self.memory_start = current
+            self.peak = current
+        profiler._stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        profiler = self.profiler
+        profiler._stack.pop()
+        allocated = 0
+        peak = 0
+        if profiler.trace_memory and tracemalloc.is_tracing():
+            current, traced_peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, traced_peak)
+            allocated = current - self.memory_start
+            peak = self.peak - self.memory_start
+            if profiler._stack:
+                parent = profiler._stack[-1]
+                parent.peak = max(parent.peak, self.peak)
+
+        stats = profiler.phases.setdefault(self.name, {'calls': 0, 'seconds': 0.0, 'allocated_bytes': 0, 'peak_bytes': 0})
+        stats['calls'] += 1
+        stats['seconds'] += seconds
+        # Net memory still held after the phase, and the most it temporarily needed on top of what it started with
+        stats['allocated_bytes'] += allocated
+        stats['peak_bytes'] = max(stats['peak_bytes'], peak)
+        return False
+
+NO_PROFILER = Profiler(enabled=False)
+
+# Sums phases and counters of several reports, peaks are the maximum over all reports
+def merge_reports(reports: List[Dict]) -> Dict:
+    phases = {}
+    counters = {}
+    for report in reports:
+        for name, stats in report['phases'].items():
+            merged = phases.setdefault(name, {'calls': 0, 'seconds': 0.0, 'allocated_bytes': 0, 'peak_bytes': 0})
+            merged['calls'] += stats['calls']
+            merged['seconds'] += stats['seconds']
+            merged['allocated_bytes'] += stats['allocated_bytes']
+            merged['peak_bytes'] = max(merged['peak_bytes'], stats['peak_bytes'])
+        for name, value in report['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+    return {'files': len(reports), 'phases': phases, 'counters': counters}
+
+def write_report(report: Dict, path: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
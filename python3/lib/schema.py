@@ -0,0 +1,109 @@
+import struct
+from typing import List, Tuple
+
+import numpy as np
+
+from lib.math_util import Vector2, Vector3
+
+# struct format, numpy dtype and number of struct values of every field type. 'bytes<n>' fields are n opaque bytes
+FIELD_TYPES = {
+    'u8': ('B', 'u1', 1),
+    'u16': ('H', '<u2', 1),
+    'u32': ('I', '<u4', 1),
+    'f32': ('f', '<f4', 1),
+    'vec2': ('2f', ('<f4', (2,)), 2),
+    'vec3': ('3f', ('<f4', (3,)), 3),
+}
+
+# A fixed size record of the file, described once as (name, type) fields and compiled to a little endian
+# struct.Struct for single records and a packed numpy structured dtype for runs of records.
+# Values are python ints, floats, Vector2/Vector3 and bytes, in field order
+class Record:
+    def __init__(self, *fields: Tuple[str, str]):
+        self.fields = fields
+        formats = []
+        dtypes = []
+        self._value_counts = []
+        for name, field_type in fields:
+            if field_type.startswith('bytes'):
+                size = int(field_type[len('bytes'):])
+                formats.append(f'{size}s')
+                dtypes.append((name, f'V{size}'))
+                self._value_counts.append(1)
+            else:
+                struct_format, dtype, value_count = FIELD_TYPES[field_type]
+                formats.append(struct_format)
+                dtypes.append((name,) + (dtype if isinstance(dtype, tuple) else (dtype,)))
+                self._value_counts.append(value_count)
+        self.struct = struct.Struct('<' + ''.join(formats))
+        self.dtype = np.dtype(dtypes)
+        assert self.dtype.itemsize == self.struct.size
+
+    @property
+    def size(self) -> int:
+        return self.struct.size
+
+    def unpack_from(self, data, offset: int = 0) -> List:
+        flat = self.struct.unpack_from(data, offset)
+        values = []
+        index = 0
+        for (_, field_type), value_count in zip(self.fields, self._value_counts):
+            values.append(_convert(field_type, flat[index] if value_count == 1 else flat[index:index + value_count]))
+            index += value_count
+        return values
+
+    def pack(self, *values) -> bytes:
+        flat = []
+        for (_, field_type), value in zip(self.fields, values):
+            if field_type in ('vec2', 'vec3'):
+                flat.extend(value)
+            else:
+                flat.append(value)
+        return self.struct.pack(*flat)
+
+    # Packs the attributes of obj named like the fields
+    def pack_object(self, obj) -> bytes:
+        return self.pack(*(getattr(obj, name) for name, _ in self.fields))
+
+    # Decodes an array of self.dtype records column by column, returns one list of values per field
+    def columns(self, records: np.ndarray) -> List[List]:
+        columns = []
+        for name, field_type in self.fields:
+            column = records[name].reshape((-1,) + records.dtype[name].shape).tolist()
+            if field_type == 'vec3':
+                column = [Vector3(*value) for value in column]
+            elif field_type == 'vec2':
+                column = [Vector2(*value) for value in column]
+            columns.append(column)
+        return columns
+
+def _convert(field_type: str, value):
+    if field_type == 'vec3':
+        return Vector3(*value)
+    if field_type == 'vec2':
+        return Vector2(*value)
+    return value
+
+# Size of the unknown 0x80, 2, 0x30 and 2 byte blocks at the end of every keyframe
+KEYFRAME_UNKNOWN_SIZE = 0x80 + 2 + 0x30 + 2
+
+# The records of the .3db tables, shared by read_header and serialize_3db.
+# Strings and the counts in front of variable length lists are read and written separately
+MATERIAL_TRAILER = Record(('_unknown', 'u32'))
+KEYFRAME_MESH = Record(('material', 'u16'), ('unknown', 'u16'), ('triangles', 'u16'),
+                       ('texture_coordinates', 'u16'), ('vertices', 'u16'), ('brightness', 'u16'))
+KEYFRAME_TRAILER = Record(('unknown1', 'vec3'), ('unknown2', 'vec3'), ('_unknown', f'bytes{KEYFRAME_UNKNOWN_SIZE}'))
+# Around the unknown string of an animation
+ANIMATION_VALUES = Record(('_unknown_u16', 'u16'), ('_unknown_f32', 'f32'))
+ANIMATION_VECTORS = Record(('_unknown_vec1', 'vec3'), ('_unknown_vec2', 'vec3'))
+CUBE_MAP_HEADER = Record(('width', 'u16'), ('height', 'u16'), ('unknown1', 'u16'), ('unknown2', 'u16'))
+POOL_COUNTS = Record(('triangles', 'u16'), ('texture_coordinates', 'u16'), ('vertices', 'u16'),
+                     ('brightness', 'u16'), ('unknown', 'u32'))
+
+# dtype of a keyframe with mesh_count meshes: the mesh count, the meshes and the trailer
+def keyframe_dtype(mesh_count: int) -> np.dtype:
+    fields = [('mesh_count', '<u2')]
+    if mesh_count > 0:
+        fields.append(('meshes', KEYFRAME_MESH.dtype, (mesh_count,)))
+    fields.append(('trailer', KEYFRAME_TRAILER.dtype))
+    return np.dtype(fields)
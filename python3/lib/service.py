@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import traceback
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Hashable, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from lib.export import export_to_gltf
+from lib.parse_3db import Model, load_3db, parse_3db_file
+from lib.textures import DEFAULT_TEXTURE_ROOT, TextureCache
+
+# Largest accepted upload and request head
+MAX_UPLOAD_SIZE = 512 * 1024 * 1024
+MAX_HEAD_SIZE = 64 * 1024
+
+# Parsed models are charged this many times the size of their file against the model cache, pools that are decoded
+# (dequantized vertices are twice the size of the file data) take memory on top of the file
+MODEL_SIZE_FACTOR = 2
+
+# export_to_gltf settings a request can set as query parameters, with how the value is parsed
+FLAG_SETTINGS = ['quantize', 'meshopt', 'atlas']
+FLOAT_SETTINGS = ['delta_tolerance', 'frame_tolerance']
+LIST_SETTINGS = {'object': 'objects', 'animation': 'animations'}
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+# Least recently used cache that evicts entries once the sum of their sizes exceeds max_size.
+# An entry larger than max_size is not cached at all. Safe to use from several threads
+class SizeBoundedLRU:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value, size: int):
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            if size > self.max_size:
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'size': self.size, 'max_size': self.max_size,
+                    'hits': self.hits, 'misses': self.misses}
+
+@dataclass
+class ConversionRequest:
+    # Key of the model content, a path with its modification time and size or the hash of an upload
+    model_key: Tuple
+    name: str
+    output_format: str
+    settings: Dict
+    # Loads the model when it isn't cached
+    load: Callable[[], Model]
+    model_size: int
+
+    @property
+    def result_key(self) -> Tuple:
+        return self.model_key, self.output_format, json.dumps(self.settings, sort_keys=True)
+
+# Converts .3db files on request and keeps parsed models and exported files in memory, so repeated requests
+# skip parsing and exporting. Exports run in a thread pool, the models in the cache are shared between threads.
+# Textures are looked up in texture_root, converted once into texture_folder and embedded into every .glb
+class ConversionService:
+    def __init__(self, texture_folder: str, model_cache_size: int, result_cache_size: int,
+                 workers: Optional[int] = None, root: Optional[str] = None, texture_root: str = DEFAULT_TEXTURE_ROOT):
+        self.texture_cache = TextureCache(texture_folder, texture_root=texture_root)
+        self.models = SizeBoundedLRU(model_cache_size)
+        self.results = SizeBoundedLRU(result_cache_size)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export')
+        self.root = os.path.abspath(root) if root is not None else None
+        # Exports that are running, so identical requests wait for the same export
+        self._running: Dict[Tuple, asyncio.Future] = {}
+        self.requests = 0
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.texture_cache.close()
+
+    # Returns (content type, data, cache hit)
+    async def convert(self, request: ConversionRequest) -> Tuple[str, bytes, bool]:
+        self.requests += 1
+        result_key = request.result_key
+        cached = self.results.get(result_key)
+        if cached is not None:
+            return cached + (True,)
+        running = self._running.get(result_key)
+        if running is not None:
+            return (await asyncio.shield(running)) + (True,)
+
+        future = asyncio.get_running_loop().run_in_executor(self.executor, self._export, request)
+        self._running[result_key] = future
+        try:
+            result = await future
+        finally:
+            del self._running[result_key]
+        self.results.put(result_key, result, len(result[1]))
+        return result + (False,)
+
+    def _model(self, request: ConversionRequest) -> Model:
+        model = self.models.get(request.model_key)
+        if model is None:
+            model = request.load()
+            self.models.put(request.model_key, model, request.model_size * MODEL_SIZE_FACTOR)
+        return model
+
+    def _export(self, request: ConversionRequest) -> Tuple[str, bytes]:
+        model = self._model(request)
+        with tempfile.TemporaryDirectory(prefix='diggles-export-') as output_path:
+            if request.output_format == 'glb':
+                outputs = export_to_gltf(model, request.name, output_path, output_format='glb', embed_textures=True,
+                                         texture_cache=self.texture_cache, **request.settings)
+                with open(outputs[0], 'rb') as f:
+                    return 'model/gltf-binary', f.read()
+            # A .gltf comes with its .bin files and textures, they are returned together as a zip
+            outputs = export_to_gltf(model, request.name, output_path, texture_cache=self.texture_cache, **request.settings)
+            bundle_gltf(outputs[0])
+            archive = io.BytesIO()
+            with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+                for path in outputs:
+                    zip_file.write(path, os.path.basename(path))
+            return 'application/zip', archive.getvalue()
+
+    def path_request(self, path: str, query: Dict) -> ConversionRequest:
+        path = os.path.abspath(path)
+        if self.root is not None and os.path.commonpath([self.root, path]) != self.root:
+            raise RequestError(403, f'{path} is outside of {self.root}')
+        if not os.path.isfile(path):
+            raise RequestError(404, f'{path} doesn\'t exist')
+        stat = os.stat(path)
+        name = re.sub(r'[^\w.-]', '_', os.path.basename(path).removesuffix('.3db'))
+        return ConversionRequest(('path', path, stat.st_mtime_ns, stat.st_size), name, *parse_settings(query),
+                                 lambda: load_3db(path), stat.st_size)
+
+    def upload_request(self, data: bytes, query: Dict) -> ConversionRequest:
+        if not data:
+            raise RequestError(400, 'The request body has to be a .3db file')
+        # Used for file names and the Content-Disposition header
+        name = re.sub(r'[^\w.-]', '_', query.get('name', ['upload'])[0]) or 'upload'
+        digest = hashlib.sha256(data).hexdigest()
+        return ConversionRequest(('upload', digest), name, *parse_settings(query), lambda: parse_3db_file(data), len(data))
+
+    def stats(self) -> Dict:
+        return {'requests': self.requests, 'models': self.models.stats(), 'results': self.results.stats(),
+                'running': len(self._running)}
+
+# The textures of the service live in its texture folder, next to but not inside the export folder. The zip holds every
+# file by its name, so the image URIs of the .gltf are reduced to the file names as well
+def bundle_gltf(gltf_path: str):
+    with open(gltf_path, 'r', encoding='utf-8') as f:
+        gltf = json.load(f)
+    for image in gltf.get('images', []):
+        if 'uri' in image:
+            image['uri'] = image['uri'].rsplit('/', 1)[-1]
+    with open(gltf_path, 'w', encoding='utf-8') as f:
+        json.dump(gltf, f)
+
+# Output format and export_to_gltf settings of a query, e.g. ?format=gltf&quantize=1&object=baby
+def parse_settings(query: Dict) -> Tuple[str, Dict]:
+    output_format = query.get('format', ['glb'])[0]
+    if output_format not in ('glb', 'gltf'):
+        raise RequestError(400, f'Unknown format {output_format}, use glb or gltf')
+    settings = {}
+    for name in FLAG_SETTINGS:
+        if name in query and query[name][0] not in ('', '0', 'false'):
+            settings[name] = True
+    for name in FLOAT_SETTINGS:
+        if name in query:
+            try:
+                settings[name] = float(query[name][0])
+            except ValueError:
+                raise RequestError(400, f'{name} has to be a number')
+    for parameter, name in LIST_SETTINGS.items():
+        if parameter in query:
+            settings[name] = sorted(query[parameter])
+    return output_format, settings
+
+# Minimal HTTP/1.1 server on top of asyncio streams, one request per connection:
+#   GET  /convert?path=<.3db path>&format=glb|gltf&...   converts a local file
+#   POST /convert?name=<name>&format=glb|gltf&...        converts the .3db in the request body
+#   GET  /stats                                          cache statistics as JSON
+async def handle_connection(service: ConversionService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    start = time.perf_counter()
+    status, content_type, body, headers = 500, 'application/json', b'', {}
+    method, target = '-', '-'
+    try:
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.LimitOverrunError:
+            raise RequestError(431, 'Request head too large')
+        except asyncio.IncompleteReadError:
+            return
+        request_line, *header_lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = request_line.split(' ')
+        except ValueError:
+            raise RequestError(400, 'Malformed request line')
+        request_headers = {}
+        for line in header_lines:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                request_headers[key.strip().lower()] = value.strip()
+
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        if url.path == '/stats' and method == 'GET':
+            status, body = 200, json.dumps(service.stats()).encode('utf-8')
+        elif url.path == '/convert' and method in ('GET', 'POST'):
+            if method == 'GET':
+                if 'path' not in query:
+                    raise RequestError(400, 'Missing path parameter')
+                request = service.path_request(query['path'][0], query)
+            else:
+                try:
+                    length = int(request_headers.get('content-length', '0'))
+                except ValueError:
+                    raise RequestError(400, 'Invalid Content-Length')
+                if length < 0:
+                    raise RequestError(400, 'Invalid Content-Length')
+                if length > MAX_UPLOAD_SIZE:
+                    raise RequestError(413, f'Uploads are limited to {MAX_UPLOAD_SIZE} bytes')
+                if request_headers.get('expect', '').lower() == '100-continue':
+                    writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+                    await writer.drain()
+                request = service.upload_request(await reader.readexactly(length), query)
+            try:
+                content_type, body, hit = await service.convert(request)
+            except ValueError as e:
+                # Invalid settings, e.g. unknown objects or animations
+                raise RequestError(400, str(e))
+            status = 200
+            headers['X-Cache'] = 'hit' if hit else 'miss'
+            headers['Content-Disposition'] = f'attachment; filename="{request.name}_out.{"glb" if request.output_format == "glb" else "zip"}"'
+        else:
+            raise RequestError(404, f'No route for {method} {url.path}')
+    except RequestError as e:
+        status, content_type, body = e.status, 'application/json', json.dumps({'error': str(e)}).encode('utf-8')
+    except Exception:
+        traceback.print_exc()
+        status, content_type, body = 500, 'application/json', json.dumps({'error': traceback.format_exc(limit=1)}).encode('utf-8')
+
+    head = [f'HTTP/1.1 {status} {STATUS_REASONS.get(status, "")}', f'Content-Type: {content_type}',
+            f'Content-Length: {len(body)}', 'Connection: close']
+    head += [f'{key}: {value}' for key, value in headers.items()]
+    try:
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+    except ConnectionError:
+        pass
+    print(f'{method} {target} {status} {len(body)} bytes {(time.perf_counter() - start) * 1000:.1f} ms {headers.get("X-Cache", "")}')
+
+STATUS_REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 413: 'Payload Too Large',
+                  431: 'Request Header Fields Too Large', 500: 'Internal Server Error'}
+
+async def serve(service: ConversionService, host: str, port: int):
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(service, reader, writer),
+                                        host, port, limit=MAX_HEAD_SIZE)
+    print(f'Serving on http://{host}:{port}')
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,79 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from PIL import Image as PILImage
+
+# The textures are in these subfolders of the game's asset folder, the highest resolution first
+TEXTURE_FOLDERS = [
+    "m256",
+    "m128",
+    "m064",
+    "m032"
+]
+TEXTURE_FILE_ENDING = ".tga"
+# Asset folder the textures are looked up in when none is given
+DEFAULT_TEXTURE_ROOT = "./assets/in"
+
+# check if file exists in the texture folders of texture_root, take the highest version
+def find_texture(texture_name: str, texture_root: str = DEFAULT_TEXTURE_ROOT) -> Optional[str]:
+    for folder in TEXTURE_FOLDERS:
+        full_path = os.path.join(texture_root, folder, texture_name + TEXTURE_FILE_ENDING)
+        if os.path.isfile(full_path):
+            return full_path
+    return None
+
+def is_up_to_date(source_path: str, output_path: str) -> bool:
+    return os.path.isfile(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(source_path)
+
+def convert_texture(source_path: str, output_path: str):
+    # Write to a temporary file first, other processes may be converting the same texture
+    temp_path = f'{output_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    PILImage.open(source_path).save(temp_path, format='PNG')
+    os.replace(temp_path, output_path)
+
+# Converts textures to PNG in the output folder, in a thread pool so it runs in parallel with the geometry export.
+# Each texture name is resolved and converted at most once per cache, and PNGs that are newer than their
+# source are reused as they are. The sources are looked up in texture_root. One cache can be shared by all models
+# exported in a run
+class TextureCache:
+    def __init__(self, output_folder: str, max_workers: Optional[int] = None, texture_root: str = DEFAULT_TEXTURE_ROOT):
+        self.output_folder = output_folder
+        self.texture_root = texture_root
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='texture')
+        self._lock = threading.Lock()
+        # texture name -> (png path, conversion), or None if the texture doesn't exist
+        self._textures: Dict[str, Optional[tuple]] = {}
+
+    # Returns the path of the PNG for texture_name, which may still be being written, or None if there is no such texture
+    def request(self, texture_name: str) -> Optional[str]:
+        with self._lock:
+            if texture_name not in self._textures:
+                self._textures[texture_name] = self._start(texture_name)
+            entry = self._textures[texture_name]
+        return entry[0] if entry is not None else None
+
+    def _start(self, texture_name: str) -> Optional[tuple]:
+        source_path = find_texture(texture_name, self.texture_root)
+        if source_path is None:
+            return None
+        output_path = os.path.join(self.output_folder, texture_name + ".png")
+        if is_up_to_date(source_path, output_path):
+            conversion = Future()
+            conversion.set_result(None)
+        else:
+            conversion = self._executor.submit(convert_texture, source_path, output_path)
+        return output_path, conversion
+
+    # Blocks until the given textures (default: all requested ones) are written, raises if a conversion failed
+    def wait(self, texture_names: Optional[List[str]] = None):
+        with self._lock:
+            names = list(self._textures) if texture_names is None else texture_names
+            entries = [self._textures.get(name) for name in names]
+        for entry in entries:
+            if entry is not None:
+                entry[1].result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
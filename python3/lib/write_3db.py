@@ -0,0 +1,133 @@
+import io
+import struct
+from typing import BinaryIO
+
+import numpy as np
+
+from lib.parse_3db import Model, pool_as_array, quantize_vertices
+from lib.math_util import Vector2, Vector3
+from lib.schema import (Record, MATERIAL_TRAILER, KEYFRAME_MESH, KEYFRAME_TRAILER, ANIMATION_VALUES, ANIMATION_VECTORS,
+                        CUBE_MAP_HEADER, POOL_COUNTS)
+
+MAX_U16 = 0xffff
+
+# Counterpart of Deserializer, writes little endian values to a binary stream
+class Serializer:
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+
+    def write_u8(self, value: int):
+        self.stream.write(struct.pack('<B', value))
+
+    def write_u16(self, value: int):
+        self.stream.write(struct.pack('<H', value))
+
+    def write_u32(self, value: int):
+        self.stream.write(struct.pack('<I', value))
+
+    # utf-8 encoded, prefixed with its length
+    def write_string(self, value: str):
+        encoded = value.encode('utf-8')
+        self.write_u32(len(encoded))
+        self.stream.write(encoded)
+
+    def write_f32(self, value: float):
+        self.stream.write(struct.pack('<f', value))
+
+    def write_vec2(self, value: Vector2):
+        self.write_f32(value.x)
+        self.write_f32(value.y)
+
+    def write_vec3(self, value: Vector3):
+        self.write_f32(value.x)
+        self.write_f32(value.y)
+        self.write_f32(value.z)
+
+    def write_bytes(self, value: bytes):
+        self.stream.write(value)
+
+    def write_array(self, value: np.ndarray, dtype):
+        self.stream.write(np.ascontiguousarray(value, dtype=np.dtype(dtype)).tobytes())
+
+    # Writes the attributes of obj named like the fields of a schema record
+    def write_record(self, record: Record, obj):
+        self.stream.write(record.pack_object(obj))
+
+def check_u16(value: int, what: str) -> int:
+    if not 0 <= value <= MAX_U16:
+        raise ValueError(f'{what} ({value}) doesn\'t fit into 16 bits')
+    return value
+
+# Writes the model in the layout read_header and parse_3db_file read. Vertices are quantized back to u16,
+# so a model that was read from a file is written back bit for bit.
+# Pools are written one entry at a time, so lazily loaded or generated pools are never all in memory at once
+def serialize_3db(model: Model, serializer: Serializer):
+    serializer.write_string(model.db_version)
+    serializer.write_string(model.name)
+
+    serializer.write_u16(check_u16(len(model.materials), 'Material count'))
+    for material in model.materials:
+        serializer.write_string(material.name)
+        serializer.write_string(material.texture_path)
+        serializer.write_record(MATERIAL_TRAILER, material)
+
+    serializer.write_u32(len(model.keyframes))
+    for keyframe in model.keyframes:
+        serializer.write_u16(check_u16(len(keyframe.meshes), 'Meshes per keyframe'))
+        for keyframe_mesh in keyframe.meshes:
+            serializer.write_record(KEYFRAME_MESH, keyframe_mesh)
+        serializer.write_record(KEYFRAME_TRAILER, keyframe)
+
+    serializer.write_u16(check_u16(len(model.objects), 'Object count'))
+    for object_name, animation_idxs in model.objects.items():
+        serializer.write_string(object_name)
+        serializer.write_u16(check_u16(len(animation_idxs), f'Animation count of {object_name}'))
+        for animation_idx in animation_idxs:
+            serializer.write_u32(animation_idx)
+
+    serializer.write_u16(check_u16(len(model.animations), 'Animation count'))
+    for animation in model.animations:
+        serializer.write_string(animation.name)
+        serializer.write_u16(check_u16(len(animation.keyframes), f'Frame count of {animation.name}'))
+        serializer.write_array(animation.keyframes, '<u4')
+        serializer.write_record(ANIMATION_VALUES, animation)
+        serializer.write_string(animation._unknown_string)
+        serializer.write_record(ANIMATION_VECTORS, animation)
+
+    serializer.write_u16(check_u16(len(model.shadow_data), 'Shadow count'))
+    for shadow in model.shadow_data:
+        serializer.write_array(pool_as_array(shadow, 'u1').reshape(32, 32), 'u1')
+
+    serializer.write_u16(check_u16(len(model.cube_map_data), 'Cube map count'))
+    for cube_map in model.cube_map_data:
+        serializer.write_record(CUBE_MAP_HEADER, cube_map)
+        serializer.write_array(cube_map.pixels.reshape(cube_map.height, cube_map.width), 'u1')
+
+    pools = [model.triangle_data, model.texture_coordinates_data, model.vertex_data, model.brightness_data]
+    if len(model._unknown_records) % 20 != 0:
+        raise ValueError('Unknown records must be 20 bytes each')
+    serializer.write_bytes(POOL_COUNTS.pack(*[check_u16(len(pool), 'Pool count') for pool in pools], len(model._unknown_records) // 20))
+
+    # Count tables, in elements (triangle indices, texture coordinates, vertices, brightness values)
+    for pool in pools:
+        serializer.write_array([check_u16(len(entry), 'Pool entry size') for entry in pool], '<u2')
+    serializer.write_bytes(model._unknown_records)
+
+    for entry in model.triangle_data:
+        serializer.write_array(pool_as_array(entry, '<u2'), '<u2')
+    for entry in model.texture_coordinates_data:
+        serializer.write_array(pool_as_array(entry, '<f4', 2), '<f4')
+    for entry in model.vertex_data:
+        serializer.write_array(quantize_vertices(pool_as_array(entry, np.float64, 3)), '<u2')
+    for entry in model.brightness_data:
+        serializer.write_array(pool_as_array(entry, 'u1'), 'u1')
+
+# Inverse of parse_3db_file
+def write_3db(model: Model) -> bytes:
+    stream = io.BytesIO()
+    serialize_3db(model, Serializer(stream))
+    return stream.getvalue()
+
+def save_3db(model: Model, path: str):
+    with open(path, 'wb') as f:
+        serialize_3db(model, Serializer(f))
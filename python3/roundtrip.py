@@ -0,0 +1,66 @@
+import argparse
+import os
+import sys
+import tempfile
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from lib.model_cache import load_3db_cached
+from lib.parse_3db import Model, load_3db, parse_3db_file
+from lib.write_3db import write_3db
+from benchmarks.synthetic import SyntheticSpec, synthetic_model
+
+DEFAULT_MODEL = os.path.join(os.path.dirname(__file__), '..', 'assets', 'baby.3db')
+
+# None if written is the same as expected, otherwise where they differ
+def compare(expected: bytes, written: bytes) -> Optional[str]:
+    if written == expected:
+        return None
+    length = min(len(expected), len(written))
+    differences = np.flatnonzero(np.frombuffer(expected, 'u1', length) != np.frombuffer(written, 'u1', length))
+    offset = differences[0] if len(differences) > 0 else length
+    return f'differs at byte {offset} ({len(written)} bytes written, {len(expected)} expected)'
+
+# Every way a model can be read, each paired with how it is labelled in the report
+def loaders(path: str, data: bytes, cache_folder: str) -> List[Tuple[str, Callable[[], Model]]]:
+    return [
+        ('parse_3db_file', lambda: parse_3db_file(data)),
+        ('load_3db', lambda: load_3db(path)),
+        # The first call writes the cache file, the second one reads the model back from it
+        ('model cache (written)', lambda: load_3db_cached(path, cache_folder)),
+        ('model cache (read)', lambda: load_3db_cached(path, cache_folder)),
+    ]
+
+parser = argparse.ArgumentParser(description='Check that .3db files are written back bit for bit after reading them')
+parser.add_argument('files', nargs='*', help=f'.3db files to check (default: {os.path.normpath(DEFAULT_MODEL)})')
+parser.add_argument('--no-synthetic', dest='synthetic', action='store_false',
+                    help="don't check a synthetic model written by write_3db")
+args = parser.parse_args()
+
+failed = 0
+with tempfile.TemporaryDirectory() as work_folder:
+    paths = [os.path.normpath(path) for path in args.files or [DEFAULT_MODEL]]
+    if args.synthetic:
+        # A generated model is written once, then it has to survive being read and written again like any other file
+        synthetic_path = os.path.join(work_folder, 'synthetic.3db')
+        with open(synthetic_path, 'wb') as f:
+            f.write(write_3db(synthetic_model(SyntheticSpec())))
+        paths.append(synthetic_path)
+
+    for path in paths:
+        with open(path, 'rb') as f:
+            expected = f.read()
+        for label, load in loaders(path, expected, os.path.join(work_folder, 'cache')):
+            try:
+                error = compare(expected, write_3db(load()))
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+            if error is None:
+                print(f'{path} via {label}: ok')
+            else:
+                print(f'{path} via {label}: {error}', file=sys.stderr)
+                failed += 1
+
+print(f'{failed} failed')
+sys.exit(1 if failed else 0)
@@ -1,19 +1,77 @@
-from lib.parse_3db import parse_3db_file
-from lib.export import export_to_gltf
+import argparse
 import os
+import sys
 
-input_folder = './assets/in'
-output_folder = './assets/out'
+from lib.batch import convert_batch
+from lib.files import find_models
 
-load_all = False
-selected_models = ["ringe.3db"]
+parser = argparse.ArgumentParser(description='Convert Diggles .3db files to glTF')
+parser.add_argument('input_folder', nargs='?', default='./assets/in')
+parser.add_argument('output_folder', nargs='?', default='./assets/out')
+parser.add_argument('-g', '--glob', dest='patterns', action='append',
+                    help="files to convert, relative to the input folder (default: '*.3db', can be repeated, '**' recurses)")
+parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                    help='number of worker processes (default: number of CPUs)')
+parser.add_argument('-f', '--force', action='store_true',
+                    help='convert all files, even if they are up to date according to the build manifest')
+parser.add_argument('--glb', action='store_true', help='write a single .glb per model instead of .gltf + .bin files')
+parser.add_argument('--embed-textures', action='store_true', help='pack the textures into the .glb')
+parser.add_argument('--stream', action='store_true',
+                    help='write the binary data to disk while exporting instead of keeping it in memory, for huge models')
+parser.add_argument('--quantize', action='store_true',
+                    help='store positions, morph deltas, texture coordinates and indices as 16-bit integers (KHR_mesh_quantization)')
+parser.add_argument('--meshopt', action='store_true',
+                    help='optimize the vertex order and compress the buffers with EXT_meshopt_compression (needs meshoptimizer)')
+parser.add_argument('--delta-tolerance', type=float, default=0.0,
+                    help='morph target vertices that move less than this are stored as not moving at all (model units, the model spans 100)')
+parser.add_argument('--frame-tolerance', type=float,
+                    help='drop animation frames that interpolating between their neighbours rebuilds within this distance (model units)')
+parser.add_argument('--object', dest='objects', action='append',
+                    help='only export this object, can be repeated (default: all objects)')
+parser.add_argument('--animation', dest='animations', action='append',
+                    help='only export this animation, can be repeated (default: all animations)')
+parser.add_argument('--atlas', action='store_true',
+                    help='pack the textures of each model into one atlas shared by all its meshes, which are merged per object')
+parser.add_argument('--images', action='store_true',
+                    help='also write the shadows and cube maps of every model as PNGs')
+parser.add_argument('--textures', metavar='FOLDER',
+                    help='folder with the m256, m128, m064 and m032 texture folders (default: the input folder)')
+parser.add_argument('--model-cache-dir', metavar='FOLDER',
+                    help='keep parsed models in this folder, so converting an unchanged .3db again maps it instead of parsing it')
+parser.add_argument('--profile', action='store_true',
+                    help='write the time and memory of every conversion phase to <name>_profile.json and batch_profile.json')
+args = parser.parse_args()
 
-for filename in os.listdir(input_folder):
-    if load_all or (not load_all and filename in selected_models):
-        if filename.endswith('.3db'):
-            model_path = os.path.join(input_folder, filename)
-            print(f'Loading model from {model_path}')
-            with open(model_path, 'rb') as f:
-                file_data = f.read()
-                model = parse_3db_file(file_data)
-                export_to_gltf(model, filename.removesuffix('.3db'), output_folder)
+settings = {}
+if args.glb:
+    settings['output_format'] = 'glb'
+if args.embed_textures:
+    settings['embed_textures'] = True
+if args.stream:
+    settings['streaming'] = True
+if args.quantize:
+    settings['quantize'] = True
+if args.meshopt:
+    settings['meshopt'] = True
+if args.delta_tolerance:
+    settings['delta_tolerance'] = args.delta_tolerance
+if args.frame_tolerance is not None:
+    settings['frame_tolerance'] = args.frame_tolerance
+if args.atlas:
+    settings['atlas'] = True
+if args.images:
+    settings['images'] = True
+if args.objects:
+    settings['objects'] = args.objects
+if args.animations:
+    settings['animations'] = args.animations
+
+model_paths = find_models(args.input_folder, args.patterns or ['*.3db'])
+print(f'Converting {len(model_paths)} files from {args.input_folder} with {args.jobs} workers')
+summary = convert_batch(model_paths, args.output_folder, args.jobs, settings, args.force, args.profile, args.model_cache_dir,
+                        args.textures or args.input_folder)
+
+for result in summary.failed:
+    print(f'Failed: {result.model_path}\n{result.error}', file=sys.stderr)
+print(summary.report())
+sys.exit(1 if summary.failed else 0)
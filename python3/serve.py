@@ -0,0 +1,31 @@
+import argparse
+import asyncio
+import os
+import tempfile
+
+from lib.service import ConversionService, serve
+from lib.textures import DEFAULT_TEXTURE_ROOT
+
+parser = argparse.ArgumentParser(description='Local HTTP service that converts Diggles .3db files to glTF on request')
+parser.add_argument('--host', default='127.0.0.1')
+parser.add_argument('--port', type=int, default=8765)
+parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of export threads (default: number of CPUs)')
+parser.add_argument('--model-cache', type=int, default=512, help='memory for parsed models in MB (default: 512)')
+parser.add_argument('--result-cache', type=int, default=256, help='memory for exported files in MB (default: 256)')
+parser.add_argument('--textures', help='folder the converted textures are kept in (default: a temporary folder)')
+parser.add_argument('--root', help='only convert files below this folder')
+parser.add_argument('--texture-root', metavar='FOLDER',
+                    help='folder with the m256, m128, m064 and m032 texture folders (default: --root, else ./assets/in)')
+args = parser.parse_args()
+
+with tempfile.TemporaryDirectory(prefix='diggles-textures-') as temporary_folder:
+    texture_folder = args.textures or temporary_folder
+    os.makedirs(texture_folder, exist_ok=True)
+    service = ConversionService(texture_folder, args.model_cache * 1024 * 1024, args.result_cache * 1024 * 1024,
+                                args.jobs, args.root, args.texture_root or args.root or DEFAULT_TEXTURE_ROOT)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()